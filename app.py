@@ -1,31 +1,252 @@
-from flask import Flask, render_template, request, jsonify, session, send_from_directory
-import pandas as pd
+from flask import Flask, render_template, request, jsonify, session, send_from_directory, Response, abort, g
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_cookie
+from werkzeug.security import safe_join
 import numpy as np
 import joblib
 import random
 import string
+import gzip
+import math
 import os
+import io
+import json
 import time
-from datetime import datetime, timedelta
-from PIL import Image, ImageDraw, ImageFont, ImageFilter
-from gtts import gTTS
+import heapq
+import bisect
+import cProfile
+import wave
+import warnings
+import shutil
+import secrets
+import hmac
+import hashlib
+import ipaddress
+import base64
+import struct
+import threading
+import multiprocessing
+import atexit
+import subprocess
+from array import array
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future
+from PIL import Image, ImageDraw, ImageFont, features as pil_features
+from features import WindowStream, WINDOW_COLUMNS
+from forest import FlatForest
+
+try:
+    from gtts import gTTS  # Optional online voice backend
+except ImportError:
+    gTTS = None
+
+try:
+    import redis  # Optional shared session backend
+except ImportError:
+    redis = None
+
+try:
+    import brotli  # Optional br variant of precompressed pages
+except ImportError:
+    brotli = None
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+class Metrics:
+    """
+    Process-local counters and fixed-bucket latency histograms, rendered in the
+    Prometheus text format. Observing is a bisect and two increments under a lock.
+    Work done inside ProcessRenderer workers is not seen here.
+    """
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    HELP = {
+        'captcha_phase_seconds': 'Time spent in one phase of challenge handling',
+        'captcha_challenge_seconds': 'Time to build a challenge in /get_current_challenge, by stage',
+        'captcha_request_seconds': 'Request handling time by endpoint (excluding session save)',
+        'captcha_challenges_total': 'Challenges by stage and outcome',
+        'captcha_profiles_total': 'Requests captured by the sampling profiler',
+        'captcha_model_reloads_total': 'Bot detector models hot-swapped in since startup',
+        'captcha_render_cache_total': 'Lazy challenge image fetches by cache result',
+        'captcha_shed_total': 'Requests answered with 429, by reason and endpoint',
+        'captcha_encoded_bytes_total': 'Bytes of challenge images encoded, by stage and encoder',
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (name, labels) -> [per-bucket counts..., +Inf count, sum]
+        self.counters = {}    # (name, labels) -> value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.BUCKETS, seconds)
+        with self.lock:
+            entry = self.histograms.get(key)
+            if entry is None:
+                entry = self.histograms[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            entry[index] += 1
+            entry[-1] += seconds
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def span(self, phase):
+        """Time a block into captcha_phase_seconds{phase=...}"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('captcha_phase_seconds', time.perf_counter() - start, phase=phase)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+    def render(self, samples=()):
+        """
+        Prometheus text exposition of everything recorded so far.
+        samples: [(name, type, help, [(labels dict, value), ...]), ...] read by the caller.
+        """
+        with self.lock:
+            histograms = {key: list(entry) for key, entry in self.histograms.items()}
+            counters = dict(self.counters)
+        lines = []
+        typed = set()
+        def header(name, kind, help_text=None):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# HELP {name} {help_text or self.HELP.get(name, name)}')
+                lines.append(f'# TYPE {name} {kind}')
+
+        for (name, labels), entry in sorted(histograms.items()):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.BUCKETS + ('+Inf',), entry[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{self._labels(labels)} {entry[-1]:.6f}')
+            lines.append(f'{name}_count{self._labels(labels)} {cumulative}')
+        for (name, labels), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f'{name}{self._labels(labels)} {value}')
+        for name, kind, help_text, values in samples:
+            header(name, kind, help_text)
+            for labels, value in values:
+                lines.append(f'{name}{self._labels(sorted(labels.items()))} {value}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+# ============================================================================
+# ASSET CACHE
+# ============================================================================
+
+class AssetCache:
+    """
+    Decoded RGBA copies of the background and object PNGs, keyed by path and mtime,
+    plus resized variants. Every lookup re-stats the file, so a rewritten asset is
+    decoded again on its next use. Sprite scales are quantized so only a handful of
+    sizes are ever produced per asset. Directory listings are cached until
+    invalidate() is called, so call it after adding or removing asset files.
+    """
+    SCALE_STEP = 0.05
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.images = {}    # path -> (mtime_ns, decoded RGBA image)
+        self.resized = {}   # (path, mtime_ns, size) -> resized RGBA image
+        self.listings = {}  # directory -> sorted list of .png names
+
+    def list_pngs(self, directory):
+        """Cached listing of the .png files in a directory"""
+        with self.lock:
+            if directory not in self.listings:
+                try:
+                    self.listings[directory] = sorted(f for f in os.listdir(directory) if f.endswith('.png'))
+                except OSError:
+                    self.listings[directory] = []
+            return self.listings[directory]
+
+    def _load(self, path):
+        # Caller holds the lock
+        cached = self.images.get(path)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            if cached is None:
+                raise
+            return cached  # Deleted since it was decoded: keep serving the copy we have
+        if cached is None or cached[0] != mtime:
+            if cached is not None:
+                # Resized variants of the old file are stale now
+                for key in [k for k in self.resized if k[0] == path]:
+                    del self.resized[key]
+            cached = self.images[path] = (mtime, Image.open(path).convert('RGBA'))
+        return cached
+
+    def get(self, path):
+        """Decoded RGBA image (shared, do not modify in place)"""
+        with self.lock:
+            return self._load(path)[1]
+
+    def get_resized(self, path, size):
+        """Image resized to an exact size (shared, do not modify in place)"""
+        with self.lock:
+            mtime, image = self._load(path)
+            key = (path, mtime, size)
+            if key not in self.resized:
+                self.resized[key] = image.resize(size)
+            return self.resized[key]
+
+    def get_scaled(self, path, scale):
+        """Image scaled by a factor snapped to SCALE_STEP (shared, do not modify in place)"""
+        scale = round(scale / self.SCALE_STEP) * self.SCALE_STEP
+        w, h = self.get(path).size
+        return self.get_resized(path, (int(w * scale), int(h * scale)))
+
+    def invalidate(self, path=None):
+        """Forget one asset (and its directory listing), or everything if no path is given"""
+        with self.lock:
+            if path is None:
+                self.images.clear()
+                self.resized.clear()
+                self.listings.clear()
+                return
+            self.images.pop(path, None)
+            self.listings.pop(os.path.dirname(path), None)
+            for key in [k for k in self.resized if k[0] == path]:
+                del self.resized[key]
+
+asset_cache = AssetCache()
 
 # ============================================================================
 # COMPOSITE CAPTCHA CLASS (Merged from composite_captcha.py)
 # ============================================================================
 
 class CompositeCaptcha:
-    def __init__(self, static_folder='static'):
+    def __init__(self, static_folder='static', assets=None):
         self.static_folder = static_folder
         self.assets_dir = os.path.join(static_folder, 'assets')
         self.bg_dir = os.path.join(self.assets_dir, 'backgrounds')
         self.obj_dir = os.path.join(self.assets_dir, 'objects')
+        self.assets = assets or asset_cache
         
         # Ensure directories exist
         os.makedirs(self.bg_dir, exist_ok=True)
         os.makedirs(self.obj_dir, exist_ok=True)
         
-        self.backgrounds = [f for f in os.listdir(self.bg_dir) if f.endswith('.png')]
+        self.backgrounds = self.assets.list_pngs(self.bg_dir)
         self.objects = {
             'cars': 'car.png',
             'traffic_lights': 'traffic_light.png',
@@ -37,30 +258,20 @@ class CompositeCaptcha:
     def glom_path(self, *args):
         return os.path.join(*args)
 
-    def create_composite_image(self, target_category, is_target_present=True, num_distractors=2):
+    def plan_composite(self, target_category, is_target_present=True, num_distractors=2, rng=random):
         """
-        Creates a composite image.
+        Decide everything about a composite image without drawing it. All random
+        choices come from rng, so a seeded random.Random gives the same plan every time.
         Returns:
-            filename: str,
+            plan: (background name or None, [(object path, scale, x, y), ...]),
             target_box: tuple (x1, y1, x2, y2) or None if not present/applicable
         """
-        # Reload backgrounds in case they were just generated
-        self.backgrounds = [f for f in os.listdir(self.bg_dir) if f.endswith('.png')]
+        # Cached listing, refreshed when check_and_create_assets writes new backgrounds
+        self.backgrounds = self.assets.list_pngs(self.bg_dir)
         
         # 1. Select Background
-        if not self.backgrounds:
-            # Fallback if no backgrounds
-            bg = Image.new('RGBA', self.size, (200, 200, 200))
-        else:
-            bg_name = random.choice(self.backgrounds)
-            bg_path = self.glom_path(self.bg_dir, bg_name)
-            try:
-                bg = Image.open(bg_path).convert('RGBA')
-            except:
-                bg = Image.new('RGBA', self.size, (200, 200, 200))
-            
-        bg = bg.resize(self.size)
-
+        bg_name = rng.choice(self.backgrounds) if self.backgrounds else None
+        placements = []
         target_box = None
         
         # 2. Place Target (if valid)
@@ -69,21 +280,17 @@ class CompositeCaptcha:
             obj_path = self.glom_path(self.obj_dir, obj_name)
             
             try:
-                obj = Image.open(obj_path).convert('RGBA')
                 # Resize object to reasonable size (e.g., 20-30% of bg)
-                obj_w, obj_h = obj.size
-                scale = random.uniform(0.3, 0.5)
-                new_size = (int(obj_w * scale), int(obj_h * scale))
-                obj = obj.resize(new_size)
+                scale = rng.uniform(0.3, 0.5)
+                new_size = self.assets.get_scaled(obj_path, scale).size
                 
                 # Random position
                 max_x = self.size[0] - new_size[0]
                 max_y = self.size[1] - new_size[1]
-                x = random.randint(0, max(0, max_x))
-                y = random.randint(0, max(0, max_y))
+                x = rng.randint(0, max(0, max_x))
+                y = rng.randint(0, max(0, max_y))
                 
-                # Paste
-                bg.paste(obj, (x, y), obj)
+                placements.append((obj_path, scale, x, y))
                 target_box = (x, y, x + new_size[0], y + new_size[1])
                 
             except Exception as e:
@@ -93,31 +300,39 @@ class CompositeCaptcha:
         distractor_cats = [c for c in self.objects.keys() if c != target_category]
         if distractor_cats:
             for _ in range(num_distractors):
-                d_cat = random.choice(distractor_cats)
-                d_name = self.objects[d_cat]
+                d_cat = rng.choice(distractor_cats)
+                d_path = self.glom_path(self.obj_dir, self.objects[d_cat])
                 try:
-                    d_obj = Image.open(self.glom_path(self.obj_dir, d_name)).convert('RGBA')
-                    # Resize
-                    d_w, d_h = d_obj.size
-                    scale = random.uniform(0.2, 0.4)
-                    new_size = (int(d_w * scale), int(d_h * scale))
-                    d_obj = d_obj.resize(new_size)
+                    scale = rng.uniform(0.2, 0.4)
+                    new_size = self.assets.get_scaled(d_path, scale).size
                     
-                    x = random.randint(0, self.size[0] - new_size[0])
-                    y = random.randint(0, self.size[1] - new_size[1])
+                    x = rng.randint(0, self.size[0] - new_size[0])
+                    y = rng.randint(0, self.size[1] - new_size[1])
                     
-                    # Simple paste (no overlap check for speed, can be improved)
-                    bg.paste(d_obj, (x, y), d_obj)
+                    # No overlap check for speed, can be improved
+                    placements.append((d_path, scale, x, y))
                 except:
                     pass
 
-        # 4. Save
-        output_dir = self.glom_path(self.static_folder, 'generated_captchas')
-        os.makedirs(output_dir, exist_ok=True)
-        filename = f"comp_{int(time.time()*1000)}_{random.randint(0,1000)}.png"
-        bg.save(os.path.join(output_dir, filename))
-        
-        return f"generated_captchas/{filename}", target_box
+        return (bg_name, placements), target_box
+
+    def draw_composite(self, plan):
+        """Draw a plan from plan_composite as a PIL.Image (RGBA)"""
+        bg_name, placements = plan
+        if bg_name is None:
+            # Fallback if no backgrounds
+            bg = Image.new('RGBA', self.size, (200, 200, 200))
+        else:
+            try:
+                # Copy: the cached background is shared and we paste onto it
+                bg = self.assets.get_resized(self.glom_path(self.bg_dir, bg_name), self.size).copy()
+            except:
+                bg = Image.new('RGBA', self.size, (200, 200, 200))
+
+        for path, scale, x, y in placements:
+            obj = self.assets.get_scaled(path, scale)
+            bg.paste(obj, (x, y), obj)
+        return bg
 
 # ============================================================================
 # ASSET GENERATION (Merged from create_placeholders.py)
@@ -180,28 +395,862 @@ def check_and_create_assets():
     os.makedirs('static/assets/objects', exist_ok=True)
     
     # Create assets if they don't exist
-    if not os.path.exists('static/assets/backgrounds/street.png'): create_street_bg()
-    if not os.path.exists('static/assets/backgrounds/nature.png'): create_nature_bg()
-    if not os.path.exists('static/assets/objects/car.png'): create_car()
-    if not os.path.exists('static/assets/objects/traffic_light.png'): create_traffic_light()
-    if not os.path.exists('static/assets/objects/crosswalk.png'): create_crosswalk()
+    assets = [
+        ('static/assets/backgrounds/street.png', create_street_bg),
+        ('static/assets/backgrounds/nature.png', create_nature_bg),
+        ('static/assets/objects/car.png', create_car),
+        ('static/assets/objects/traffic_light.png', create_traffic_light),
+        ('static/assets/objects/crosswalk.png', create_crosswalk),
+    ]
+    for path, create in assets:
+        if not os.path.exists(path):
+            create()
+            # Drop any cached decode/listing so the renderer picks up the new file
+            asset_cache.invalidate(path)
+
+# ============================================================================
+# CHALLENGE STORE
+# ============================================================================
+
+class ChallengeStore:
+    """
+    In-memory store for encoded challenge media (images, audio), keyed by opaque
+    unguessable IDs. Every blob gets the same TTL, so insertion order is expiry
+    order and eviction only ever looks at the oldest entries.
+    """
+    def __init__(self, ttl=600, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.blobs = OrderedDict()  # id -> (expires_at, mimetype, data)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def put(self, data, mimetype):
+        """Store encoded bytes and return their ID"""
+        blob_id = secrets.token_urlsafe(16)
+        with self.lock:
+            self.blobs[blob_id] = (time.time() + self.ttl, mimetype, data)
+            self.total_bytes += len(data)
+            self._evict()
+        return blob_id
+
+    def get(self, blob_id):
+        """Return (data, mimetype), or None if unknown or expired"""
+        with self.lock:
+            entry = self.blobs.get(blob_id)
+            if entry is None or entry[0] < time.time():
+                return None
+            return entry[2], entry[1]
+
+    def _evict(self):
+        # Caller holds the lock. Drop expired blobs, then the oldest ones while over budget
+        now = time.time()
+        while self.blobs:
+            blob_id, (expires_at, _, data) = next(iter(self.blobs.items()))
+            if expires_at >= now and self.total_bytes <= self.max_bytes:
+                break
+            del self.blobs[blob_id]
+            self.total_bytes -= len(data)
+
+class ExpiryIndex:
+    """
+    Min-heap of (expires_at, path) for challenge files written to disk. Files are
+    added when they are created, so a sweep only touches files that have expired
+    instead of listing and stat-ing whole directories.
+    """
+    def __init__(self):
+        self.heap = []
+        self.lock = threading.Lock()
+
+    def add(self, path, ttl, created=None):
+        """Schedule a file for deletion ttl seconds after it was created"""
+        expires_at = (created if created is not None else time.time()) + ttl
+        with self.lock:
+            heapq.heappush(self.heap, (expires_at, path))
+
+    def add_directory(self, directory, ttl):
+        """Index files already on disk (one scan, used at startup)"""
+        if not os.path.exists(directory):
+            return
+        for filename in os.listdir(directory):
+            filepath = os.path.join(directory, filename)
+            if os.path.isfile(filepath):
+                self.add(filepath, ttl, created=os.path.getmtime(filepath))
+
+    def sweep(self, now=None):
+        """Delete every file whose expiry has passed and return how many were removed"""
+        now = now if now is not None else time.time()
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                expired.append(heapq.heappop(self.heap)[1])
+        for filepath in expired:
+            try:
+                os.remove(filepath)
+            except:
+                pass
+        return len(expired)
+
+class RenderCache:
+    """
+    Byte-bounded LRU of lazily rendered challenge media. Concurrent first fetches
+    of the same key wait for one render instead of each doing it.
+    """
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (data, mimetype), least recently used first
+        self.inflight = {}            # key -> Future of the render in progress
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, render_fn):
+        """Cached (data, mimetype) for key, calling render_fn() on a miss"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            else:
+                future = self.inflight.get(key)
+                owner = future is None
+                if owner:
+                    future = self.inflight[key] = Future()
+        if entry is not None:
+            metrics.inc('captcha_render_cache_total', result='hit')
+            return entry
+        if not owner:
+            metrics.inc('captcha_render_cache_total', result='shared')
+            return future.result()
+
+        metrics.inc('captcha_render_cache_total', result='miss')
+        try:
+            entry = render_fn()
+        except Exception as e:
+            with self.lock:
+                del self.inflight[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.inflight[key]
+            self.entries[key] = entry
+            self.total_bytes += len(entry[0])
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (data, _) = self.entries.popitem(last=False)
+                self.total_bytes -= len(data)
+        future.set_result(entry)
+        return entry
+
+# ============================================================================
+# VOICE ENGINE
+# ============================================================================
+
+class VoiceUnavailable(Exception):
+    """Raised when no voice backend could produce a challenge"""
+
+class GlyphVoice:
+    """
+    Offline voice CAPTCHA synthesis. One clip per character is loaded once at
+    startup (the clips are committed under static/assets/voice; missing ones are
+    rendered with a local espeak-ng/espeak install), and each challenge is built
+    by splicing those clips with random gaps, speed/pitch jitter and noise.
+    Challenges are 8 kHz, 8-bit mono WAV: telephone quality, about 8 KB per
+    second of audio, and playable in every browser without an encoder library.
+    """
+    GLYPHS = string.ascii_uppercase + string.digits
+
+    def __init__(self, clip_dir='static/assets/voice', sample_rate=8000):
+        self.clip_dir = clip_dir
+        self.sample_rate = sample_rate
+        self.clips = {}  # glyph -> float32 samples in [-1, 1]
+
+    @property
+    def available(self):
+        return len(self.clips) == len(self.GLYPHS)
+
+    def load(self):
+        """Load every glyph clip, rendering missing ones if a local TTS binary exists"""
+        os.makedirs(self.clip_dir, exist_ok=True)
+        tts_binary = shutil.which('espeak-ng') or shutil.which('espeak')
+        for glyph in self.GLYPHS:
+            path = os.path.join(self.clip_dir, f'{glyph}.wav')
+            if not os.path.exists(path) and tts_binary:
+                try:
+                    subprocess.run([tts_binary, '-s', '120', '-w', path, glyph], check=True, capture_output=True)
+                except Exception as e:
+                    print(f"Error rendering voice clip for {glyph}: {e}")
+            try:
+                self.clips[glyph] = self._read_wav(path)
+            except Exception:
+                pass
+        return self.available
+
+    def _read_wav(self, path):
+        with wave.open(path, 'rb') as wav:
+            width = wav.getsampwidth()
+            channels = wav.getnchannels()
+            rate = wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+        if width == 1:
+            samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+        elif width == 2:
+            samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768
+        else:
+            raise ValueError(f"Unsupported sample width {width} in {path}")
+        if channels > 1:
+            samples = samples.reshape(-1, channels).mean(axis=1)
+        if rate > self.sample_rate:
+            # Cut what the lower rate can't carry, or sibilants alias into the speech band
+            samples = self._lowpass(samples, 0.45 * self.sample_rate / rate)
+        return self._resample(samples, self.sample_rate / rate)
+
+    @staticmethod
+    def _lowpass(samples, cutoff, taps=63):
+        """Windowed-sinc low-pass filter, cutoff in cycles per sample"""
+        n = np.arange(taps) - (taps - 1) / 2
+        kernel = np.sinc(2 * cutoff * n) * np.hamming(taps)
+        return np.convolve(samples, kernel / kernel.sum(), mode='same').astype(np.float32)
+
+    @staticmethod
+    def _resample(samples, factor):
+        """Linear resample; factor > 1 stretches (slower, lower), factor < 1 squeezes"""
+        length = max(1, int(len(samples) * factor))
+        positions = np.linspace(0, len(samples) - 1, length)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+    def synthesize(self, text):
+        """Return WAV bytes speaking the characters of text"""
+        parts = [np.zeros(int(self.sample_rate * 0.3), dtype=np.float32)]
+        for glyph in text:
+            clip = self._resample(self.clips[glyph], random.uniform(0.85, 1.15))
+            parts.append(clip * random.uniform(0.7, 1.0))
+            parts.append(np.zeros(int(self.sample_rate * random.uniform(0.35, 0.8)), dtype=np.float32))
+        audio = np.concatenate(parts)
+        audio += np.random.normal(0, 0.02, len(audio)).astype(np.float32)
+        audio = np.clip(audio / max(1.0, float(np.abs(audio).max())), -1, 1)
+
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(1)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(np.round(audio * 127 + 128).astype(np.uint8).tobytes())
+        return buffer.getvalue()
+
+# ============================================================================
+# BATCHED INFERENCE
+# ============================================================================
+
+class BatchScorer:
+    """
+    Micro-batching front end for the bot detector. Request threads queue their
+    feature rows and block; one background thread flushes the queue as a single
+    predict_proba call once max_batch rows are waiting or the oldest request has
+    waited max_delay seconds.
+    """
+    def __init__(self, model, max_batch=64, max_delay=0.002, history=1000):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = []  # (rows, future, enqueued_at)
+        self.pending_rows = 0
+        self.cond = threading.Condition()
+        self.history = deque(maxlen=history)  # (rows, requests, queue_ms, predict_ms) per batch
+        self.totals = {'batches': 0, 'rows': 0, 'requests': 0}
+
+    def start(self):
+        threading.Thread(target=self._run, name='detector-batcher', daemon=True).start()
+        return self
+
+    def score(self, rows):
+        """Bot probability for each feature row (blocks until its batch is scored)"""
+        future = Future()
+        with self.cond:
+            self.pending.append((rows, future, time.perf_counter()))
+            self.pending_rows += len(rows)
+            self.cond.notify()
+        return future.result()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                deadline = self.pending[0][2] + self.max_delay
+                while self.pending_rows < self.max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch, self.pending, self.pending_rows = self.pending, [], 0
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        model = self.model  # Read once: a hot-swap only takes effect from the next batch
+        try:
+            X = np.vstack([rows for rows, _, _ in batch])
+            bot_column = list(model.classes_).index('bot')
+            probabilities = model.predict_proba(X)[:, bot_column]
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        finished = time.perf_counter()
+
+        offsets = np.cumsum([len(rows) for rows, _, _ in batch])[:-1]
+        for (_, future, _), result in zip(batch, np.split(probabilities, offsets)):
+            future.set_result(result)
+
+        with self.cond:
+            self.history.append((len(X), len(batch), (started - batch[0][2]) * 1000, (finished - started) * 1000))
+            self.totals['batches'] += 1
+            self.totals['rows'] += len(X)
+            self.totals['requests'] += len(batch)
+
+    def stats(self):
+        """Batch size and latency percentiles over the recent batches"""
+        with self.cond:
+            history = np.array(self.history) if self.history else np.zeros((0, 4))
+            stats = dict(self.totals)
+        if len(history):
+            for name, column in [('batch_rows', 0), ('batch_requests', 1), ('queue_ms', 2), ('predict_ms', 3)]:
+                for p in (50, 95, 99):
+                    stats[f'{name}_p{p}'] = float(np.percentile(history[:, column], p))
+        return stats
+
+class ModelWatcher:
+    """
+    Polls the published model file and hands each new version to on_load.
+    Models are published with an atomic rename, so a changed file signature
+    always means a complete new file. Requests keep being scored by the old
+    model until the swap, which is a single reference assignment.
+    """
+    def __init__(self, path, on_load, interval=5.0):
+        self.path = path
+        self.on_load = on_load
+        self.interval = interval
+        self.signature = self._signature()
+
+    def start(self):
+        threading.Thread(target=self._run, name='model-watcher', daemon=True).start()
+        return self
+
+    def _signature(self):
+        try:
+            st = os.stat(self.path)
+            return (st.st_ino, st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            signature = self._signature()
+            if signature is None or signature == self.signature:
+                continue
+            self.signature = signature
+            try:
+                new_model = FlatForest.load(self.path)
+            except Exception as e:
+                print(f"Error loading new model from {self.path}: {e}")
+                continue
+            self.on_load(new_model)
+
+# ============================================================================
+# ADMISSION CONTROL
+# ============================================================================
+
+class Overloaded(Exception):
+    """Raised when a request is shed (rate limited, or too much render work queued)"""
+
+class RateLimiter:
+    """
+    Token buckets for any number of clients in fixed memory. Each key hashes to one
+    slot in each of `rows` arrays (a count-min sketch); a slot holds the debt run
+    up by the keys on it, which drains at `rate` per second. A request is admitted
+    while the smallest debt over its key's slots stays within `burst`. Clients that
+    share slots can only be limited early, never let through.
+    """
+    def __init__(self, rate=1.0, burst=30.0, slots=1 << 16, rows=2):
+        self.rate = rate
+        self.burst = burst
+        self.slots = slots
+        self.rows = rows
+        self.debt = [array('d', bytes(8 * slots)) for _ in range(rows)]
+        self.updated = [array('d', bytes(8 * slots)) for _ in range(rows)]
+        self.lock = threading.Lock()
+
+    def _cells(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=4 * self.rows).digest()
+        return [int.from_bytes(digest[4 * r:4 * r + 4], 'little') % self.slots for r in range(self.rows)]
+
+    def allow(self, keys, cost=1.0):
+        """Charge cost to every key, or to none of them if any key is over its budget"""
+        now = time.monotonic()
+        cells = [self._cells(key) for key in keys]
+        with self.lock:
+            levels = []
+            for slots in cells:
+                level = None
+                for r, i in enumerate(slots):
+                    # Time decay: drain what has accumulated since the slot was last touched
+                    debt = max(0.0, self.debt[r][i] - (now - self.updated[r][i]) * self.rate)
+                    self.debt[r][i] = debt
+                    self.updated[r][i] = now
+                    level = debt if level is None else min(level, debt)
+                if level + cost > self.burst:
+                    return False
+                levels.append(level)
+            # Conservative update: raise each slot only as far as this key needs
+            for slots, level in zip(cells, levels):
+                for r, i in enumerate(slots):
+                    self.debt[r][i] = max(self.debt[r][i], level + cost)
+            return True
+
+class AdmissionGate:
+    """
+    Global limit on render work done on request threads. Up to max_active renders
+    run at once and up to max_waiting more wait for a slot (at most timeout
+    seconds); beyond that, requests are shed straight away instead of queueing.
+    """
+    def __init__(self, max_active, max_waiting=32, timeout=1.0):
+        self.slots = threading.Semaphore(max_active)
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.waiting = 0
+        self.active = 0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def admit(self):
+        with self.lock:
+            if self.waiting >= self.max_waiting:
+                raise Overloaded("render queue too deep")
+            self.waiting += 1
+        try:
+            acquired = self.slots.acquire(timeout=self.timeout)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        if not acquired:
+            raise Overloaded("no render slot in time")
+        with self.lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+            self.slots.release()
+
+# ============================================================================
+# HTTP CACHING
+# ============================================================================
+
+class StaticFingerprints:
+    """
+    Content hashes of files under a static directory, used as ETags. A file is
+    only re-hashed when its mtime or size changes.
+    """
+    def __init__(self, root='static'):
+        self.root = root
+        self.entries = {}  # path -> (mtime_ns, size, digest)
+
+    def get(self, path):
+        full = safe_join(self.root, path)
+        try:
+            stat = os.stat(full) if full else None
+        except OSError:
+            stat = None
+        if stat is None or not os.path.isfile(full):
+            return None
+        entry = self.entries.get(path)
+        if entry is None or entry[:2] != (stat.st_mtime_ns, stat.st_size):
+            with open(full, 'rb') as f:
+                digest = hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+            entry = (stat.st_mtime_ns, stat.st_size, digest)
+            self.entries[path] = entry
+        return entry[2]
+
+class PrecompressedPage:
+    """
+    A page rendered once and kept as identity, gzip and (with brotli installed) br
+    bodies, each with its own ETag. Rebuilt only when the source file changes.
+    """
+    def __init__(self, build, source):
+        self.build = build
+        self.source = source
+        self.mtime = None
+        self.variants = {}  # encoding ('' for identity) -> (body, etag)
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        mtime = os.stat(self.source).st_mtime_ns
+        if mtime == self.mtime:
+            return
+        with self.lock:
+            if mtime == self.mtime:
+                return
+            body = self.build()
+            digest = hashlib.blake2b(body, digest_size=8).hexdigest()
+            variants = {'': (body, digest), 'gzip': (gzip.compress(body, 9, mtime=0), digest + '-gz')}
+            if brotli is not None:
+                variants['br'] = (brotli.compress(body, quality=11), digest + '-br')
+            self.variants, self.mtime = variants, mtime
+
+    def variant(self, accept_encodings):
+        """(body, content encoding or '', etag) best matching an Accept-Encoding header"""
+        self.refresh()
+        encodings = [name for name in ('br', 'gzip') if name in self.variants]
+        encoding = accept_encodings.best_match(encodings) or ''
+        body, etag = self.variants[encoding]
+        return body, encoding, etag
+
+# ============================================================================
+# SERVER-SIDE SESSIONS
+# ============================================================================
+
+class MemorySessionBackend:
+    """In-process LRU of session dicts with a sliding TTL (per worker process)"""
+    def __init__(self, ttl=1800, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # sid -> (expires_at, data), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[sid]
+                return None
+            # Touching a session slides its expiry, so LRU order is also expiry order
+            self.entries[sid] = (time.time() + self.ttl, entry[1])
+            self.entries.move_to_end(sid)
+            return dict(entry[1])
+
+    def set(self, sid, data):
+        now = time.time()
+        with self.lock:
+            self.entries[sid] = (now + self.ttl, data)
+            self.entries.move_to_end(sid)
+            while self.entries:
+                oldest = next(iter(self.entries.values()))
+                if oldest[0] >= now and len(self.entries) <= self.max_entries:
+                    break
+                self.entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self.lock:
+            self.entries.pop(sid, None)
+
+class RedisSessionBackend:
+    """Session dicts stored as JSON in Redis (or anything speaking its protocol, e.g. fakeredis)"""
+    def __init__(self, client, ttl=1800, prefix='captcha:session:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, sid):
+        raw = self.client.getex(self.prefix + sid, ex=self.ttl)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, sid, data):
+        self.client.set(self.prefix + sid, json.dumps(data), ex=self.ttl)
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Keeps the verification state on the server; the cookie only carries an opaque
+    random session ID and is only sent when a new session is created.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            with metrics.span('session_load'):
+                data = self.backend.get(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified or session.new:
+            with metrics.span('session_save'):
+                self.backend.set(session.sid, dict(session))
+        if session.new:
+            response.set_cookie(
+                name, session.sid, domain=domain, path=path,
+                httponly=self.get_cookie_httponly(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
+# ============================================================================
+# IMAGE ENCODING
+# ============================================================================
+
+class ImageEncoder:
+    """
+    One output format for challenge images: PIL save options plus the media type
+    and file extension it is served with. Encoded bytes are recognized again by
+    their signature, so pooled or cached images carry their format with them.
+    """
+    def __init__(self, format, mimetype, ext, signature, offset=0, **options):
+        self.format = format
+        self.mimetype = mimetype
+        self.ext = ext
+        self.signature = signature
+        self.offset = offset
+        self.options = options
+
+    @property
+    def available(self):
+        return self.format != 'WEBP' or pil_features.check('webp')
+
+    def encode(self, image):
+        # Composites are drawn as RGBA but fully opaque, dropping alpha only saves bytes
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        image.save(buffer, format=self.format, **self.options)
+        return buffer.getvalue()
+
+    def matches(self, data):
+        return data[self.offset:self.offset + len(self.signature)] == self.signature
+
+# Presets, from PIL's defaults to the fastest settings of each format
+IMAGE_ENCODERS = {
+    'png': ImageEncoder('PNG', 'image/png', '.png', b'\x89PNG'),
+    'png-fast': ImageEncoder('PNG', 'image/png', '.png', b'\x89PNG', compress_level=1),
+    'webp': ImageEncoder('WEBP', 'image/webp', '.webp', b'WEBP', offset=8, quality=80, method=4),
+    'webp-fast': ImageEncoder('WEBP', 'image/webp', '.webp', b'WEBP', offset=8, quality=80, method=0),
+    'webp-lossless': ImageEncoder('WEBP', 'image/webp', '.webp', b'WEBP', offset=8, lossless=True, quality=0, method=0),
+    'jpeg': ImageEncoder('JPEG', 'image/jpeg', '.jpg', b'\xff\xd8\xff', quality=85),
+    'jpeg-fast': ImageEncoder('JPEG', 'image/jpeg', '.jpg', b'\xff\xd8\xff', quality=75),
+}
+
+def encoder_of(data):
+    """The encoder that produced some image bytes (by signature)"""
+    for encoder in IMAGE_ENCODERS.values():
+        if encoder.matches(data):
+            return encoder
+    raise ValueError("Unknown image format")
+
+# ============================================================================
+# TEXT CAPTCHA ENGINE
+# ============================================================================
+
+class TextCaptchaRenderer:
+    """
+    Text CAPTCHA renderer that works on NumPy pixel arrays. The font is loaded and
+    every glyph rasterized (at a set of rotation angles) once; a batch of challenges
+    is then composed, warped, noised and blurred with array operations over the
+    whole batch, and only the final image encode is per image. Random choices come
+    from rng (np.random, or a seeded np.random.RandomState for repeatable images).
+    """
+    GLYPHS = string.ascii_uppercase + string.digits
+    ANGLES = range(-20, 21, 5)  # Pre-rotated glyph variants (degrees)
+
+    def __init__(self, size=(300, 100), font_size=48, bg_color=(5, 5, 5),
+                 text_color=(0, 242, 255), dot_color=(0, 200, 255)):
+        self.width, self.height = size
+        self.bg_color = np.array(bg_color, dtype=np.float32)
+        self.text_color = np.array(text_color, dtype=np.float32)
+        self.dot_color = np.array(dot_color, dtype=np.float32)
+        self.glyphs = {}  # glyph -> [alpha mask (float32) per angle]
+        font = self._load_font(font_size)
+        for glyph in self.GLYPHS:
+            left, top, right, bottom = font.getbbox(glyph)
+            mask = Image.new('L', (right - left + 2, bottom - top + 2), 0)
+            ImageDraw.Draw(mask).text((1 - left, 1 - top), glyph, fill=255, font=font)
+            self.glyphs[glyph] = [
+                np.asarray(mask.rotate(angle, resample=Image.BILINEAR, expand=True), dtype=np.float32) / 255
+                for angle in self.ANGLES
+            ]
+
+    @staticmethod
+    def _load_font(font_size):
+        try:
+            return ImageFont.truetype("arial.ttf", font_size)
+        except:
+            try:
+                return ImageFont.load_default(size=font_size)
+            except TypeError:
+                return ImageFont.load_default()  # Pillow < 10.1 has no scalable default
+
+    def _place_glyphs(self, texts, rng):
+        """Alpha layer (batch, height, width) with the rotated glyphs of every text"""
+        layer = np.zeros((len(texts), self.height, self.width), dtype=np.float32)
+        for b, text in enumerate(texts):
+            masks = [self.glyphs[glyph][rng.randint(len(self.ANGLES))] for glyph in text]
+            spacing = 4
+            total = sum(m.shape[1] for m in masks) + spacing * (len(masks) - 1)
+            x = max(0, (self.width - total) // 2)
+            for mask in masks:
+                h, w = mask.shape
+                y = min(max(0, (self.height - h) // 2 + rng.randint(-8, 9)), max(0, self.height - h))
+                h, w = min(h, self.height - y), min(w, self.width - x)
+                if w <= 0:
+                    break
+                np.maximum(layer[b, y:y + h, x:x + w], mask[:h, :w], out=layer[b, y:y + h, x:x + w])
+                x += w + spacing
+        return layer
+
+    def _warp(self, layer, rng):
+        """Independent sine-wave displacement of every image in the batch"""
+        count = len(layer)
+        ys = np.arange(self.height, dtype=np.float32)[None, :, None]
+        xs = np.arange(self.width, dtype=np.float32)[None, None, :]
+        amplitude = rng.uniform(2, 5, (count, 1, 1)).astype(np.float32)
+        period = rng.uniform(60, 120, (count, 1, 1)).astype(np.float32)
+        phase = rng.uniform(0, 2 * np.pi, (count, 2, 1, 1)).astype(np.float32)
+        # Horizontal shift depends on the row, vertical shift on the column
+        shift_x = np.rint(amplitude * np.sin(2 * np.pi * ys / period + phase[:, 0])).astype(np.intp)
+        shift_y = np.rint(amplitude * np.sin(2 * np.pi * xs / period + phase[:, 1])).astype(np.intp)
+        src_x = np.clip(np.arange(self.width)[None, None, :] + shift_x, 0, self.width - 1)
+        src_y = np.clip(np.arange(self.height)[None, :, None] + shift_y, 0, self.height - 1)
+        # One flat gather over the whole batch
+        flat = (np.arange(count)[:, None, None] * self.height + src_y) * self.width + src_x
+        return np.take(layer.reshape(-1), flat)
+
+    def _noise(self, layer, rng, lines=5, dots=100):
+        """Add 2px noise lines to the text layer and return a separate dot layer"""
+        count = len(layer)
+        batch = np.arange(count)[:, None, None]
+        # Lines: sample points densely along each segment
+        start = rng.uniform(0, 1, (count, lines, 1, 2)) * (self.width, self.height)
+        end = rng.uniform(0, 1, (count, lines, 1, 2)) * (self.width, self.height)
+        steps = np.linspace(0, 1, self.width + self.height)[None, None, :, None]
+        points = np.rint(start + (end - start) * steps).astype(np.intp)
+        px = np.clip(points[..., 0], 0, self.width - 1)
+        py = np.clip(points[..., 1], 0, self.height - 1)
+        layer[batch, py, px] = 1.0
+        layer[batch, np.clip(py + 1, 0, self.height - 1), px] = 1.0
+        # Dots
+        dot_layer = np.zeros_like(layer)
+        dx = rng.randint(0, self.width, (count, dots))
+        dy = rng.randint(0, self.height, (count, dots))
+        dot_layer[np.arange(count)[:, None], dy, dx] = 1.0
+        return dot_layer
+
+    @staticmethod
+    def _blur(layers):
+        """Separable 5-tap binomial blur (about a radius-1 Gaussian) along the last two axes"""
+        kernel = np.array([1, 4, 6, 4, 1], dtype=np.float32) / 16
+        for axis in (-2, -1):
+            length = layers.shape[axis]
+            pad = [(0, 0)] * layers.ndim
+            pad[axis] = (2, 2)
+            padded = np.pad(layers, pad, mode='edge')
+            window = [slice(None)] * layers.ndim
+            out = np.zeros_like(layers)
+            for i, k in enumerate(kernel):
+                window[axis] = slice(i, i + length)
+                out += k * padded[tuple(window)]
+            layers = out
+        return layers
+
+    def render_arrays(self, texts, rng=np.random):
+        """(batch, height, width, 3) uint8 pixels for a list of texts"""
+        text_layer = self._warp(self._place_glyphs(texts, rng), rng)
+        dot_layer = self._noise(text_layer, rng)
+        # Blur the two coverage layers, then colorize (cheaper than blurring RGB)
+        text_layer, dot_layer = self._blur(np.stack((text_layer, dot_layer)))
+        rgb = self.bg_color + text_layer[..., None] * (self.text_color - self.bg_color)
+        rgb += dot_layer[..., None] * (self.dot_color - rgb)
+        return np.clip(rgb, 0, 255).astype(np.uint8)
+
+    def render_batch(self, texts, rng=np.random):
+        """Encoded image bytes for every text"""
+        with metrics.span('render_text'):
+            pixels = self.render_arrays(texts, rng)
+        return [encode_image(Image.fromarray(image, 'RGB'), 'text') for image in pixels]
 
 # ============================================================================
 # MAIN APPLICATION
 # ============================================================================
 
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-change-in-production-2026'  # Change this in production!
+app = Flask(__name__, static_folder=None)  # static/ is served by serve_static (caching policy below)
+DEFAULT_SECRET_KEY = 'your-secret-key-change-in-production-2026'
+app.secret_key = os.environ.get('CAPTCHA_SECRET_KEY', DEFAULT_SECRET_KEY)  # Set CAPTCHA_SECRET_KEY in production!
+
+# Verification state (stage, attempts, answers) lives server-side; the cookie only
+# holds a session ID. 'memory' is per worker process, 'redis' is shared across
+# workers, 'cookie' is Flask's signed-cookie session.
+app.config['SESSION_BACKEND'] = 'memory'
+app.config['SESSION_TTL'] = 1800                  # Seconds of inactivity before a session is dropped
+app.config['SESSION_MAX_ENTRIES'] = 100000        # Memory backend LRU bound
+app.config['SESSION_REDIS_URL'] = 'redis://localhost:6379/0'
+
+if app.config['SESSION_BACKEND'] == 'memory':
+    app.session_interface = ServerSessionInterface(MemorySessionBackend(
+        ttl=app.config['SESSION_TTL'],
+        max_entries=app.config['SESSION_MAX_ENTRIES']
+    ))
+elif app.config['SESSION_BACKEND'] == 'redis':
+    if redis is None:
+        raise RuntimeError("SESSION_BACKEND is 'redis' but the redis package is not installed")
+    app.session_interface = ServerSessionInterface(RedisSessionBackend(
+        redis.Redis.from_url(app.config['SESSION_REDIS_URL']),
+        ttl=app.config['SESSION_TTL']
+    ))
 
+# HTTP caching. Files under static/ are served with their content hash as ETag, so
+# a browser revalidating an unchanged file gets a bodiless 304. Per-challenge media
+# is never cached. The index page is rendered and compressed once (again only if
+# the template changes).
+app.config['STATIC_NO_STORE_DIRS'] = ['images', 'audio', 'challenge_images', 'generated_captchas']
+
+static_fingerprints = StaticFingerprints('static')
+index_page = PrecompressedPage(
+    lambda: render_template('index.html').encode('utf-8'),
+    os.path.join(app.root_path, app.template_folder, 'index.html')
+)
 # Load your trained AI brain (if available)
+# The flat export is memory-mapped, so forked workers share one copy of the forest;
+# the joblib pickle is only the fallback for models trained before it existed
+# (it was fitted on a DataFrame, but serving passes plain NumPy feature rows)
+warnings.filterwarnings('ignore', message='X does not have valid feature names')
 try:
-    model = joblib.load('captcha_guard.pkl')
+    model = FlatForest.load('captcha_guard.npz')
 except:
-    model = None # Handle missing model gracefully
+    try:
+        model = joblib.load('captcha_guard.pkl')
+    except:
+        model = None # Handle missing model gracefully
+if model is not None and getattr(model, 'n_features_in_', None) != len(WINDOW_COLUMNS):
+    print("captcha_guard model predates windowed features, re-run process_data.py and train_model.py")
+    model = None
 
 # Initialize Composite Captcha Generator
 composite_gen = CompositeCaptcha()
 
+# Text CAPTCHA engine (font and glyph rasters are prepared once here)
+text_engine = TextCaptchaRenderer()
+
 # Ensure static directories exist
 os.makedirs('static/audio', exist_ok=True)
 os.makedirs('static/images', exist_ok=True)
@@ -211,69 +1260,325 @@ os.makedirs('static/generated_captchas', exist_ok=True)
 # Generate assets on startup
 check_and_create_assets()
 
+# Challenge rendering: 'inline' renders on the calling thread, 'process' uses a
+# pool of warm worker processes (PIL holds the GIL for much of the work)
+app.config['RENDER_BACKEND'] = 'inline'
+app.config['RENDER_WORKERS'] = os.cpu_count()  # Worker processes for the 'process' backend
+app.config['RENDER_MAX_PENDING'] = 64          # Queued render jobs before callers have to wait
+app.config['RENDER_TIMEOUT'] = 2.0             # Seconds to wait for a queue slot before giving up
+
+# Image challenge grid: one 3x3 sprite sheet (1 encode, 1 request) sliced by the
+# client with CSS, instead of 9 separate images
+app.config['IMAGE_GRID_SPRITE'] = True
+
+# Encoder preset per challenge stage (a key of IMAGE_ENCODERS). Lossy WebP at its
+# fastest effort encodes faster than PNG and at a fraction of the size for every
+# stage; compare the presets on this machine with: python benchmark.py --encoders
+app.config['IMAGE_ENCODING'] = {
+    'text': 'webp-fast',
+    'image': 'webp-fast',
+    'part': 'webp-fast',
+}
+for stage, name in app.config['IMAGE_ENCODING'].items():
+    if not IMAGE_ENCODERS[name].available:
+        print(f"Pillow was built without {IMAGE_ENCODERS[name].format} support, encoding {stage} challenges as PNG")
+        app.config['IMAGE_ENCODING'][stage] = 'png'
+
+# Image challenge pool settings
+app.config['CHALLENGE_POOL_SIZE'] = 4        # Max ready grids kept per category
+app.config['CHALLENGE_POOL_LOW_WATER'] = 2   # Refill once a category drops below this
+app.config['CHALLENGE_POOL_WORKERS'] = 2     # Background render threads
+app.config['CHALLENGE_POOL_MAX_AGE'] = 1800  # Seconds before a pooled challenge is considered stale
+app.config['TEXT_POOL_SIZE'] = 64            # Max ready text challenges
+app.config['TEXT_POOL_LOW_WATER'] = 16       # Refill once fewer than this are ready
+app.config['TEXT_POOL_BATCH'] = 32           # Text challenges rendered per batch call
+
+# Challenge media storage: 'lazy' hands out signed seed tokens and renders an image
+# only when it is fetched (nothing is rendered for clients that never load it),
+# 'memory' serves pre-rendered bytes from the ChallengeStore, 'disk' writes files
+# under static/ like before. Voice clips are kept in memory in 'lazy' mode.
+app.config['CHALLENGE_STORAGE'] = 'lazy'
+app.config['CHALLENGE_STORE_TTL'] = 600                     # Seconds (also how long lazy tokens stay valid)
+app.config['CHALLENGE_STORE_MAX_BYTES'] = 64 * 1024 * 1024  # Memory budget for stored blobs
+app.config['RENDER_CACHE_MAX_BYTES'] = 32 * 1024 * 1024     # LRU budget for lazily rendered images
+
+# Lazy tokens are signed, and their render seeds (hence the answers) derived, with a
+# secret of their own that is never committed. Set CAPTCHA_CHALLENGE_SECRET when
+# several processes serve the same clients; otherwise each process draws one.
+app.config['CHALLENGE_SECRET'] = os.environ.get('CAPTCHA_CHALLENGE_SECRET', '').encode('utf-8') or secrets.token_bytes(32)
+if app.config['CHALLENGE_STORAGE'] == 'lazy' and app.secret_key == DEFAULT_SECRET_KEY:
+    print("Lazy challenges are disabled while app.secret_key is the committed default "
+          "(set CAPTCHA_SECRET_KEY), using CHALLENGE_STORAGE 'memory'")
+    app.config['CHALLENGE_STORAGE'] = 'memory'
+
+challenge_store = ChallengeStore(
+    ttl=app.config['CHALLENGE_STORE_TTL'],
+    max_bytes=app.config['CHALLENGE_STORE_MAX_BYTES']
+)
+render_cache = RenderCache(max_bytes=app.config['RENDER_CACHE_MAX_BYTES'])
+
+# Voice CAPTCHA backend: 'local' splices the pre-rendered glyph clips in
+# static/assets/voice (falls back to gTTS if they are missing), 'gtts' always
+# calls the online service
+app.config['VOICE_BACKEND'] = 'local'
+
+voice_engine = GlyphVoice()
+if not voice_engine.load():
+    print("Voice clips missing from static/assets/voice (restore them or install espeak-ng), using gTTS")
+
+# Behavioral risk scoring of /telemetry mouse batches
+app.config['RISK_MIN_WINDOWS'] = 5           # Scored movement windows needed before a verdict
+app.config['RISK_HUMAN_THRESHOLD'] = 0.2     # Mean bot probability at or below this is human
+app.config['RISK_BOT_THRESHOLD'] = 0.8       # Mean bot probability at or above this is a bot
+app.config['TELEMETRY_MAX_POINTS'] = 500     # Samples accepted per batch
+
+# Micro-batching of detector calls from concurrent request threads
+app.config['DETECTOR_BATCH_SIZE'] = 64       # Flush once this many feature rows are queued
+app.config['DETECTOR_BATCH_DELAY'] = 0.002   # ...or once the oldest request has waited this long (seconds)
+
+detector = BatchScorer(
+    model,
+    max_batch=app.config['DETECTOR_BATCH_SIZE'],
+    max_delay=app.config['DETECTOR_BATCH_DELAY']
+) if model is not None else None
+
+# New model versions published by train_model.py / retrain.py are picked up
+# without a restart (0 turns the polling off)
+app.config['MODEL_RELOAD_INTERVAL'] = 5.0    # Seconds between checks of captcha_guard.npz
+
+def install_model(new_model):
+    """Swap a newly published model in for all following detector batches"""
+    global model, detector
+    if getattr(new_model, 'n_features_in_', None) != len(WINDOW_COLUMNS):
+        print("Ignoring published model: it wasn't trained on the windowed features")
+        return
+    if detector is None:
+        detector = BatchScorer(
+            new_model,
+            max_batch=app.config['DETECTOR_BATCH_SIZE'],
+            max_delay=app.config['DETECTOR_BATCH_DELAY']
+        ).start()
+    else:
+        detector.model = new_model
+    model = new_model
+    metrics.inc('captcha_model_reloads_total')
+    print(f"Loaded new bot detector model ({len(new_model.roots)} trees)")
+
+if app.config['MODEL_RELOAD_INTERVAL']:
+    model_watcher = ModelWatcher('captcha_guard.npz', install_model, interval=app.config['MODEL_RELOAD_INTERVAL'])
+
+# Disk mode: challenge files are deleted this long after they are written
+app.config['CHALLENGE_FILE_TTL'] = 3600  # Seconds
+
+expiry_index = ExpiryIndex()
+for directory in ['static/images', 'static/audio', 'static/generated_captchas']:
+    expiry_index.add_directory(directory, app.config['CHALLENGE_FILE_TTL'])
+
+# Instrumentation: /metrics serves the Prometheus text format. The sampling profiler
+# is off unless PROFILE_SAMPLE_RATE > 0; sampled requests are written as .prof files
+# (python -m pstats profiles/<file>.prof)
+app.config['PROFILE_SAMPLE_RATE'] = 0.0      # Fraction of requests to profile, e.g. 0.01
+app.config['PROFILE_DIR'] = 'profiles'
+
+# Internal endpoints (/metrics, /detector_stats) show how the app and the detector behave, which a
+# bot could tune itself against, so they answer only these client addresses or
+# networks and are a 404 for everyone else. Behind a reverse proxy on the same host,
+# wrap the app in ProxyFix (or don't proxy these paths) so the proxy isn't the client.
+app.config['INTERNAL_ALLOWED_NETWORKS'] = ['127.0.0.1/32', '::1/128']
+
+# Admission control in front of the routes: token buckets per client IP and per
+# session (in a fixed-size sketch, so memory doesn't grow with the number of
+# clients), a global limit on render work done on request threads, and a cheap
+# 429 once too much of it is queued. Behind a reverse proxy, wrap the app in
+# werkzeug's ProxyFix so remote_addr is the client and not the proxy.
+app.config['RATE_LIMIT_ENABLED'] = True
+app.config['RATE_LIMIT_RATE'] = 1.0          # Tokens refilled per second per client
+app.config['RATE_LIMIT_BURST'] = 30.0        # Tokens a client can spend at once
+app.config['RATE_LIMIT_SLOTS'] = 1 << 16     # Buckets per sketch row (2 rows, 16 bytes per bucket)
+app.config['RATE_LIMIT_COSTS'] = {           # Tokens per request, by endpoint (others are free)
+    'get_current_challenge': 1.0,
+    'serve_lazy_challenge': 1.0,
+    'serve_challenge': 0.2,
+    'start_verification': 0.5,
+    'verify_captcha': 0.5,
+    'telemetry': 0.05,
+}
+app.config['RENDER_MAX_ACTIVE'] = os.cpu_count() or 4  # Concurrent renders on request threads
+app.config['RENDER_MAX_WAITING'] = 32        # Requests waiting for a render slot before shedding
+app.config['RENDER_WAIT_TIMEOUT'] = 1.0      # Seconds a request waits for a render slot
+
+rate_limiter = RateLimiter(
+    rate=app.config['RATE_LIMIT_RATE'],
+    burst=app.config['RATE_LIMIT_BURST'],
+    slots=app.config['RATE_LIMIT_SLOTS']
+)
+render_gate = AdmissionGate(
+    app.config['RENDER_MAX_ACTIVE'],
+    max_waiting=app.config['RENDER_MAX_WAITING'],
+    timeout=app.config['RENDER_WAIT_TIMEOUT']
+)
+
+CHALLENGE_CATEGORIES = ['cars', 'traffic_lights', 'crosswalks']
+
 # ============================================================================
 # UTILITY FUNCTIONS
 # ============================================================================
 
-def generate_random_text(length=6):
+def generate_random_text(length=6, rng=random):
     """Generate random alphanumeric text for CAPTCHA"""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
+    return ''.join(rng.choices(string.ascii_uppercase + string.digits, k=length))
 
-def create_captcha_image(text):
-    """Create a distorted image with the given text"""
-    width, height = 300, 100
-    bg_color = (5, 5, 5)
-    text_color = (0, 242, 255)
-    
-    image = Image.new('RGB', (width, height), bg_color)
-    draw = ImageDraw.Draw(image)
-    
+def encode_image(image, stage):
+    """Encode a PIL image with the encoder configured for a challenge stage"""
+    name = app.config['IMAGE_ENCODING'][stage]
+    with metrics.span('encode_image'):
+        data = IMAGE_ENCODERS[name].encode(image)
+    metrics.inc('captcha_encoded_bytes_total', len(data), stage=stage, encoder=name)
+    return data
+
+def internal_only():
+    """Abort with a 404 unless the client is in INTERNAL_ALLOWED_NETWORKS"""
     try:
-        font = ImageFont.truetype("arial.ttf", 48)
-    except:
-        font = ImageFont.load_default()
-    
-    # Draw text
-    text_width = draw.textlength(text, font=font) if hasattr(draw, 'textlength') else len(text) * 30
-    position = ((width - text_width) / 2, 20)
-    draw.text(position, text, fill=text_color, font=font)
-    
-    # Add noise lines
-    for _ in range(5):
-        start = (random.randint(0, width), random.randint(0, height))
-        end = (random.randint(0, width), random.randint(0, height))
-        draw.line([start, end], fill=(0, 242, 255, 100), width=2)
-    
-    # Add noise dots
-    for _ in range(100):
-        xy = (random.randint(0, width), random.randint(0, height))
-        draw.point(xy, fill=(0, 200, 255))
-    
-    image = image.filter(ImageFilter.GaussianBlur(radius=1))
-    
-    filename = f'captcha_{int(time.time()*1000)}.png'
-    filepath = os.path.join('static/images', filename)
-    image.save(filepath)
-    
-    return filename
+        address = ipaddress.ip_address(request.remote_addr)
+    except ValueError:
+        abort(404)
+    if not any(address in ipaddress.ip_network(network) for network in app.config['INTERNAL_ALLOWED_NETWORKS']):
+        abort(404)
+
+def publish_media(data, mimetype, subdir, prefix, ext):
+    """Make encoded challenge media available to the client and return its URL"""
+    with metrics.span('publish'):
+        if app.config['CHALLENGE_STORAGE'] in ('memory', 'lazy'):
+            return f'/challenge/{challenge_store.put(data, mimetype)}'
+        filename = f'{prefix}_{int(time.time()*1000)}_{random.randint(0,1000)}{ext}'
+        filepath = os.path.join('static', subdir, filename)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        expiry_index.add(filepath, app.config['CHALLENGE_FILE_TTL'])
+        return f'/static/{subdir}/{filename}'
+
+def publish_image(data, subdir, prefix):
+    """publish_media for encoded challenge images, in whatever format they were encoded"""
+    encoder = encoder_of(data)
+    return publish_media(data, encoder.mimetype, subdir, prefix, encoder.ext)
+
+# Lazy challenges: the URL token names (kind, category, tile), a random nonce and
+# an expiry, signed with CHALLENGE_SECRET. The render seed is derived from the nonce
+# with that secret too, so a client can't rebuild an image or its answer from the token.
+CHALLENGE_KINDS = ['grid', 'part', 'text']
+SPRITE_TILE = 255  # Tile number of a whole grid sprite sheet
+_TOKEN_FORMAT = '>BBBI8s'  # kind, category, tile, expires_at, nonce
+_TOKEN_MAC_BYTES = 12
+
+def _secret():
+    return app.config['CHALLENGE_SECRET']
+
+def challenge_seed(kind, category, nonce):
+    """Render seed of a lazy challenge (shared by every tile of a grid)"""
+    message = b'seed:' + f'{kind}:{category or ""}:'.encode('utf-8') + nonce
+    return int.from_bytes(hmac.new(_secret(), message, hashlib.sha256).digest()[:8], 'big')
+
+def challenge_url(kind, category, tile, nonce):
+    """URL of a lazily rendered challenge image"""
+    payload = struct.pack(
+        _TOKEN_FORMAT, CHALLENGE_KINDS.index(kind), CHALLENGE_CATEGORIES.index(category) if category else 0,
+        tile, int(time.time()) + app.config['CHALLENGE_STORE_TTL'], nonce
+    )
+    mac = hmac.new(_secret(), payload, hashlib.sha256).digest()[:_TOKEN_MAC_BYTES]
+    return '/challenge/lazy/' + base64.urlsafe_b64encode(payload + mac).decode('ascii').rstrip('=')
+
+def read_challenge_token(token):
+    """(kind, category, tile, seed) of a valid, unexpired token, or None"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except ValueError:
+        return None
+    size = struct.calcsize(_TOKEN_FORMAT)
+    payload, mac = raw[:size], raw[size:]
+    if len(raw) != size + _TOKEN_MAC_BYTES:
+        return None
+    if not hmac.compare_digest(mac, hmac.new(_secret(), payload, hashlib.sha256).digest()[:_TOKEN_MAC_BYTES]):
+        return None
+    kind, category, tile, expires_at, nonce = struct.unpack(_TOKEN_FORMAT, payload)
+    if expires_at < time.time():
+        return None
+    kind = CHALLENGE_KINDS[kind]
+    category = None if kind == 'text' else CHALLENGE_CATEGORIES[category]
+    return kind, category, tile, challenge_seed(kind, category, nonce)
+
+def render_seeded(kind, category, tile, seed):
+    """Encoded image bytes of a lazy challenge, rebuilt from its seed"""
+    rng = random.Random(seed)
+    if kind == 'text':
+        text = generate_random_text(6, rng)
+        return text_engine.render_batch([text], np.random.RandomState(seed % 2**32))[0]
+    if kind == 'part':
+        return render_part_image(category, rng)[0]
+    if tile == SPRITE_TILE:
+        return render_challenge_grid(category, True, rng)[0][0]
+    plans, _ = plan_challenge_grid(category, rng)
+    return encode_image(draw_composites([plans[tile]])[0], 'image')
+
+def render_captcha_image(text):
+    """Render a distorted image with the given text as encoded image bytes"""
+    return text_engine.render_batch([text])[0]
+
+def render_text_batch(count):
+    """Render count text challenges in one batch, returning [(text, image bytes), ...]"""
+    texts = [generate_random_text(6) for _ in range(count)]
+    return list(zip(texts, text_engine.render_batch(texts)))
+
+def create_captcha_image(text):
+    """Create a distorted image with the given text and return its URL"""
+    with render_gate.admit():
+        data = renderer.text(text)
+    return publish_image(data, 'images', 'captcha')
+
+def generate_text_challenge():
+    """
+    Hand out a lazy text challenge, or take a pre-rendered one from the pool
+    (renders inline if it is empty).
+    """
+    if app.config['CHALLENGE_STORAGE'] == 'lazy':
+        nonce = secrets.token_bytes(8)
+        text = generate_random_text(6, random.Random(challenge_seed('text', None, nonce)))
+        return text, challenge_url('text', None, 0, nonce)
+    item = text_pool.pop('text')
+    if item is None:
+        text = generate_random_text(6)
+        return text, create_captcha_image(text)
+    text, data = item
+    return text, publish_image(data, 'images', 'captcha')
 
 def create_voice_captcha(text):
-    """Create audio file with spoken text"""
+    """Create spoken audio for the given text and return its URL"""
+    if app.config['VOICE_BACKEND'] == 'local' and voice_engine.available:
+        with metrics.span('tts'):
+            audio = voice_engine.synthesize(text)
+        return publish_media(audio, 'audio/wav', 'audio', 'voice', '.wav')
+    if gTTS is None:
+        raise VoiceUnavailable("No voice backend: add clips to static/assets/voice or install gTTS")
+
     spoken_text = ' '.join(list(text))
-    filename = f'voice_{int(time.time()*1000)}.mp3'
-    filepath = os.path.join('static/audio', filename)
     
-    tts = gTTS(text=spoken_text, lang='en', slow=True)
-    tts.save(filepath)
+    try:
+        with metrics.span('tts'):
+            tts = gTTS(text=spoken_text, lang='en', slow=True)
+            buffer = io.BytesIO()
+            tts.write_to_fp(buffer)
+    except Exception as e:
+        # gTTS needs the network (gTTSError, connection errors...)
+        print(f"Error generating voice captcha: {e}")
+        raise VoiceUnavailable("gTTS failed") from e
     
-    return filename
+    return publish_media(buffer.getvalue(), 'audio/mpeg', 'audio', 'voice', '.mp3')
 
-def generate_challenge_images():
-    """Generate 9 images for image CAPTCHA using CompositeCaptcha"""
-    # 1. Select a target category
-    target_category = random.choice(['cars', 'traffic_lights', 'crosswalks'])
-    
-    images = []
+def plan_challenge_grid(target_category, rng=random):
+    """
+    Composition plans of the 9 images of an image CAPTCHA and the indices that
+    contain the target, without drawing anything. Deterministic for a seeded rng.
+    """
+    plans = []
     correct_indices = []
     
     # 2. Generate 9 images
@@ -282,7 +1587,7 @@ def generate_challenge_images():
         is_target = False
         if len(correct_indices) < 3:
              is_target = True
-        elif len(correct_indices) < 5 and random.random() > 0.5:
+        elif len(correct_indices) < 5 and rng.random() > 0.5:
              is_target = True
         
         # Balance
@@ -295,40 +1600,116 @@ def generate_challenge_images():
 
         if is_target:
             correct_indices.append(i)
-            img_path, _ = composite_gen.create_composite_image(target_category, is_target_present=True)
+            plan, _ = composite_gen.plan_composite(target_category, is_target_present=True, rng=rng)
         else:
             # Distractor
-            distractors = [c for c in ['cars', 'traffic_lights', 'crosswalks'] if c != target_category]
-            dist_cat = random.choice(distractors)
-            img_path, _ = composite_gen.create_composite_image(dist_cat, is_target_present=True)
+            distractors = [c for c in CHALLENGE_CATEGORIES if c != target_category]
+            dist_cat = rng.choice(distractors)
+            plan, _ = composite_gen.plan_composite(dist_cat, is_target_present=True, rng=rng)
             
-        images.append(f'/static/{img_path}')
+        plans.append(plan)
+    return plans, correct_indices
+
+def draw_composites(plans):
+    images = []
+    for plan in plans:
+        with metrics.span('render_composite'):
+            images.append(composite_gen.draw_composite(plan))
+    return images
+
+def render_challenge_grid(target_category, sprite=False, rng=random):
+    """
+    Render and encode the 9 composite images of an image CAPTCHA for one target
+    category. With sprite=True the tiles are packed into one 3x3 sheet and a single
+    image is returned instead of nine.
+    """
+    plans, correct_indices = plan_challenge_grid(target_category, rng)
+    images = draw_composites(plans)
         
-    return images, correct_indices, target_category
+    if sprite:
+        with metrics.span('compose_sprite'):
+            sheet = compose_sprite_sheet(images)
+        return [encode_image(sheet, 'image')], correct_indices
+    return [encode_image(image, 'image') for image in images], correct_indices
+
+def compose_sprite_sheet(tiles, columns=3):
+    """Paste equally sized tiles row by row into one sheet"""
+    tile_w, tile_h = tiles[0].size
+    rows = (len(tiles) + columns - 1) // columns
+    sheet = Image.new('RGB', (tile_w * columns, tile_h * rows))
+    for i, tile in enumerate(tiles):
+        sheet.paste(tile, ((i % columns) * tile_w, (i // columns) * tile_h))
+    return sheet
+
+def sprite_layout(url, count=9, columns=3):
+    """Tile layout of a sprite sheet for the client (pixel offsets of each tile)"""
+    tile_w, tile_h = composite_gen.size
+    rows = (count + columns - 1) // columns
+    return {
+        'url': url,
+        'width': tile_w * columns,
+        'height': tile_h * rows,
+        'columns': columns,
+        'rows': rows,
+        'tile_width': tile_w,
+        'tile_height': tile_h,
+        'tiles': [{'x': (i % columns) * tile_w, 'y': (i // columns) * tile_h} for i in range(count)]
+    }
+
+def generate_challenge_images():
+    """
+    Take a pre-rendered 9 image grid from the pool (renders inline if the pool is empty).
+    Returns (image URLs, sprite layout or None, correct indices, category).
+    """
+    # 1. Select a target category
+    target_category = random.choice(CHALLENGE_CATEGORIES)
+    
+    # Lazy: only the layout is decided now, tiles are drawn when they are fetched
+    if app.config['CHALLENGE_STORAGE'] == 'lazy':
+        nonce = secrets.token_bytes(8)
+        _, correct_indices = plan_challenge_grid(target_category, random.Random(challenge_seed('grid', target_category, nonce)))
+        if app.config['IMAGE_GRID_SPRITE']:
+            url = challenge_url('grid', target_category, SPRITE_TILE, nonce)
+            return [], sprite_layout(url), correct_indices, target_category
+        images = [challenge_url('grid', target_category, i, nonce) for i in range(9)]
+        return images, None, correct_indices, target_category
+
+    # 2. Pop a finished grid, falling back to rendering on the request thread
+    grid = challenge_pool.pop(target_category)
+    if grid is None:
+        with render_gate.admit():
+            grid = renderer.grid(target_category, app.config['IMAGE_GRID_SPRITE'])
+    encoded, correct_indices = grid
+    images = [publish_image(data, 'generated_captchas', 'comp') for data in encoded]
+    
+    # A single encoded image is a sprite sheet (pooled grids keep the format they were rendered in)
+    if len(images) == 1:
+        return [], sprite_layout(images[0]), correct_indices, target_category
+    return images, None, correct_indices, target_category
+
+def plan_part_image(target_category, rng=random):
+    """Composition plan and target box of a Part Selection image (nothing is drawn)"""
+    return composite_gen.plan_composite(target_category, is_target_present=True, num_distractors=4, rng=rng)
+
+def render_part_image(target_category, rng=random):
+    """Render and encode the Part Selection image, returning (bytes, target box)"""
+    plan, target_box = plan_part_image(target_category, rng)
+    return encode_image(draw_composites([plan])[0], 'part'), target_box
 
 def generate_part_selection_challenge():
     """Generate a single image with a specific target for Part Selection"""
-    target_category = random.choice(['cars', 'traffic_lights', 'crosswalks'])
+    target_category = random.choice(CHALLENGE_CATEGORIES)
+
+    if app.config['CHALLENGE_STORAGE'] == 'lazy':
+        nonce = secrets.token_bytes(8)
+        _, target_box = plan_part_image(target_category, random.Random(challenge_seed('part', target_category, nonce)))
+        return challenge_url('part', target_category, 0, nonce), target_box, target_category
     
     # Generate single image with target
-    img_path, target_box = composite_gen.create_composite_image(target_category, is_target_present=True, num_distractors=4)
+    with render_gate.admit():
+        data, target_box = renderer.part(target_category)
     
-    return f'/static/{img_path}', target_box, target_category
-
-def cleanup_old_files(directory, max_age_hours=1):
-    """Remove files older than specified hours"""
-    now = datetime.now()
-    if not os.path.exists(directory):
-        return
-    for filename in os.listdir(directory):
-        filepath = os.path.join(directory, filename)
-        if os.path.isfile(filepath):
-            file_time = datetime.fromtimestamp(os.path.getmtime(filepath))
-            if now - file_time > timedelta(hours=max_age_hours):
-                try:
-                    os.remove(filepath)
-                except:
-                    pass
+    return publish_image(data, 'generated_captchas', 'comp'), target_box, target_category
 
 def init_session():
     """Initialize or reset verification session"""
@@ -338,12 +1719,21 @@ def init_session():
     session['part_attempts'] = 2
     session['voice_attempts'] = 2
     session['captcha_time'] = time.time()
+    session['risk'] = 'unknown'
+    session['risk_windows'] = 0
+    session['risk_bot_sum'] = 0.0
+    session['telemetry_stream'] = None
+    session['human_retry_used'] = False
 
 def progress_to_next_stage():
     """Move to the next verification stage"""
     current = session.get('stage', 'text')
     
-    if current == 'text':
+    if current == 'text' and session.get('risk') == 'human' and not session.get('human_retry_used'):
+        # Confidently human: one more round of the cheap text stage instead of image rendering
+        session['human_retry_used'] = True
+        session['text_attempts'] = 2
+    elif current == 'text':
         session['stage'] = 'image'
     elif current == 'image':
         session['stage'] = 'part'
@@ -354,15 +1744,358 @@ def progress_to_next_stage():
     
     return session['stage']
 
+# ============================================================================
+# BEHAVIORAL RISK SCORING
+# ============================================================================
+
+def score_movements(points):
+    """
+    Score a chunk of mouse samples [[x, y, t], ...] with the bot detector, one
+    prediction per movement window rather than per sample. The session keeps the
+    unfinished window (under WINDOW_SIZE samples), so chunks of any size can be
+    sent and windows run across chunk boundaries.
+    Returns (sum of per-window bot probabilities, number of scored windows).
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.size and (points.ndim != 2 or points.shape[1] != 3):
+        raise ValueError("Expected [[x, y, t], ...]")
+    if model is None or points.size == 0:
+        return 0.0, 0
+    stream = WindowStream.from_state(session.get('telemetry_stream'))
+    features = stream.push(points[:, 0], points[:, 1], points[:, 2])
+    session['telemetry_stream'] = stream.state()
+    if len(features) == 0:
+        return 0.0, 0
+    with metrics.span('detector_score'):
+        probabilities = detector.score(features)
+    return float(probabilities.sum()), len(probabilities)
+
+def update_risk(bot_sum, count):
+    """Fold a scored batch into the session and apply the stage policy for the verdict"""
+    session['risk_bot_sum'] = session.get('risk_bot_sum', 0.0) + bot_sum
+    session['risk_windows'] = session.get('risk_windows', 0) + count
+
+    if session['risk_windows'] >= app.config['RISK_MIN_WINDOWS']:
+        bot_probability = session['risk_bot_sum'] / session['risk_windows']
+        if bot_probability <= app.config['RISK_HUMAN_THRESHOLD']:
+            session['risk'] = 'human'
+        elif bot_probability >= app.config['RISK_BOT_THRESHOLD']:
+            session['risk'] = 'bot'
+        else:
+            session['risk'] = 'unknown'
+
+    # Suspicious sessions don't get the cheap text stage
+    if session.get('risk') == 'bot' and session.get('stage', 'text') == 'text':
+        session['stage'] = 'image'
+
+    return session.get('risk', 'unknown')
+
+# ============================================================================
+# RENDERING BACKENDS
+# ============================================================================
+
+class RenderQueueFull(Exception):
+    """Raised when the render backend can't accept more work in time"""
+
+class InlineRenderer:
+    """Renders challenges on the calling thread"""
+    def grid(self, target_category, sprite=False):
+        return render_challenge_grid(target_category, sprite)
+
+    def part(self, target_category):
+        return render_part_image(target_category)
+
+    def text(self, text):
+        return render_captcha_image(text)
+
+    def text_batch(self, count):
+        return render_text_batch(count)
+
+    def seeded(self, kind, category, tile, seed):
+        return render_seeded(kind, category, tile, seed)
+
+def _warm_render_worker():
+    """ProcessPoolExecutor initializer: fresh RNG state and pre-decoded, pre-scaled assets"""
+    # Forked workers inherit the parent's RNG state. Its locks are copied too, but
+    # none can be held: the workers are forked before any thread is started.
+    random.seed()
+    np.random.seed()
+    for name in asset_cache.list_pngs(composite_gen.bg_dir):
+        asset_cache.get_resized(os.path.join(composite_gen.bg_dir, name), composite_gen.size)
+    steps = int(round(0.5 / AssetCache.SCALE_STEP))
+    for name in composite_gen.objects.values():
+        path = os.path.join(composite_gen.obj_dir, name)
+        for step in range(int(round(0.2 / AssetCache.SCALE_STEP)), steps + 1):
+            asset_cache.get_scaled(path, step * AssetCache.SCALE_STEP)
+
+class ProcessRenderer:
+    """
+    Renders challenges in a pool of warm worker processes, so PIL work isn't
+    limited by one interpreter's GIL. Results come back as encoded bytes. At most
+    max_pending jobs are queued; callers wait up to timeout seconds for a slot and
+    then get RenderQueueFull.
+    """
+    def __init__(self, workers=None, max_pending=64, timeout=2.0):
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_warm_render_worker
+        )
+        # Start (and warm) the workers now rather than on the first request
+        self.executor.submit(int).result()
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise RenderQueueFull("render queue full")
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def grid(self, target_category, sprite=False):
+        return self.run(render_challenge_grid, target_category, sprite)
+
+    def part(self, target_category):
+        return self.run(render_part_image, target_category)
+
+    def text(self, text):
+        return self.run(render_captcha_image, text)
+
+    def text_batch(self, count):
+        return self.run(render_text_batch, count)
+
+    def seeded(self, kind, category, tile, seed):
+        return self.run(render_seeded, kind, category, tile, seed)
+
+# Render workers are forked (all at once) here, after every function and setting
+# they use is defined, and before the first thread is started. Spawned workers
+# would re-import this module and build all of it again, so platforms without
+# fork render inline. Config changes made after startup don't reach the workers.
+if app.config['RENDER_BACKEND'] == 'process' and 'fork' not in multiprocessing.get_all_start_methods():
+    print("RENDER_BACKEND 'process' needs the fork start method, rendering inline")
+    app.config['RENDER_BACKEND'] = 'inline'
+if app.config['RENDER_BACKEND'] == 'process':
+    renderer = ProcessRenderer(
+        workers=app.config['RENDER_WORKERS'],
+        max_pending=app.config['RENDER_MAX_PENDING'],
+        timeout=app.config['RENDER_TIMEOUT']
+    )
+else:
+    renderer = InlineRenderer()
+
+# Background threads only start once the render workers exist
+if detector is not None:
+    detector.start()
+if app.config['MODEL_RELOAD_INTERVAL']:
+    model_watcher.start()
+
+# ============================================================================
+# CHALLENGE POOL
+# ============================================================================
+
+class ChallengePool:
+    """
+    Bounded pool of pre-rendered challenges (image grids, text images), one queue per
+    category. Background workers top each queue back up whenever it falls below the
+    low-water mark, so the request thread only has to pop a finished challenge.
+    render_fn(category, count) returns a list of count items; refills ask for up to
+    batch_size items per call.
+    """
+    def __init__(self, render_fn, categories, size=4, low_water=2, max_age=1800, workers=2, batch_size=1):
+        self.render_fn = render_fn
+        self.batch_size = batch_size
+        self.size = size
+        self.low_water = low_water
+        self.max_age = max_age
+        self.queues = {c: deque() for c in categories}
+        self.pending = {c: 0 for c in categories}
+        self.lock = threading.Lock()
+        self.closed = False
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='challenge-pool')
+        # Runs at exit before concurrent.futures shuts executors down (those hooks run
+        # newest first, ahead of atexit), so no refill submits to a closed render pool
+        getattr(threading, '_register_atexit', atexit.register)(self.close)
+
+    def pop(self, category):
+        """Return a ready challenge for the category, or None if the pool is empty"""
+        item = None
+        with self.lock:
+            queue = self.queues[category]
+            now = time.time()
+            # Drop stale grids rather than handing out old challenges
+            while queue and now - queue[0][0] > self.max_age:
+                queue.popleft()
+            if queue:
+                item = queue.popleft()[1]
+        self.refill(category)
+        return item
+
+    def refill(self, category=None):
+        """Schedule background renders for categories below the low-water mark"""
+        categories = [category] if category else list(self.queues)
+        with self.lock:
+            if self.closed:
+                return
+            for c in categories:
+                available = len(self.queues[c]) + self.pending[c]
+                if available >= self.low_water:
+                    continue
+                missing = self.size - available
+                while missing > 0:
+                    count = min(self.batch_size, missing)
+                    self.pending[c] += count
+                    missing -= count
+                    self.executor.submit(self._render, c, count)
+
+    def close(self):
+        """Stop scheduling refills and wait for the renders in progress"""
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _render(self, category, count):
+        try:
+            items = self.render_fn(category, count)
+        except Exception as e:
+            print(f"Error pre-rendering challenge: {e}")
+            items = []
+        with self.lock:
+            self.pending[category] -= count
+            now = time.time()
+            for item in items[:self.size - len(self.queues[category])]:
+                self.queues[category].append((now, item))
+
+challenge_pool = ChallengePool(
+    lambda category, count: [renderer.grid(category, app.config['IMAGE_GRID_SPRITE']) for _ in range(count)],
+    CHALLENGE_CATEGORIES,
+    size=app.config['CHALLENGE_POOL_SIZE'],
+    low_water=app.config['CHALLENGE_POOL_LOW_WATER'],
+    max_age=app.config['CHALLENGE_POOL_MAX_AGE'],
+    workers=app.config['CHALLENGE_POOL_WORKERS']
+)
+# Lazy mode never pops from the pools (they start filling on first use if the mode changes)
+if app.config['CHALLENGE_STORAGE'] != 'lazy':
+    challenge_pool.refill()
+
+# Text challenges are cheap individually, so they are rendered in batches
+text_pool = ChallengePool(
+    lambda _, count: renderer.text_batch(count),
+    ['text'],
+    size=app.config['TEXT_POOL_SIZE'],
+    low_water=app.config['TEXT_POOL_LOW_WATER'],
+    max_age=app.config['CHALLENGE_POOL_MAX_AGE'],
+    workers=1,
+    batch_size=app.config['TEXT_POOL_BATCH']
+)
+if app.config['CHALLENGE_STORAGE'] != 'lazy':
+    text_pool.refill()
+
 # ============================================================================
 # ROUTES
 # ============================================================================
 
+# Render and compress the page once at startup
+with app.app_context():
+    index_page.refresh()
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            return  # Another profiler is already running
+        g.profiler = profiler
+
+def shed_over_budget(environ, endpoint):
+    """
+    429 response if the client is over its rate limit budget for this endpoint,
+    else None. Works on the raw WSGI environ, so nothing has been done for the
+    request yet: no session is loaded and no hook has run.
+    """
+    cost = app.config['RATE_LIMIT_COSTS'].get(endpoint) if app.config['RATE_LIMIT_ENABLED'] else None
+    if not cost:
+        return None
+    keys = [f"ip:{environ.get('REMOTE_ADDR')}"]
+    # The session ID is taken from the cookie without loading the session. An unknown
+    # or forged ID only adds a fresh bucket; the IP bucket is charged either way.
+    if isinstance(app.session_interface, ServerSessionInterface):
+        sid = parse_cookie(environ.get('HTTP_COOKIE')).get(app.session_interface.get_cookie_name(app))
+        if sid:
+            keys.append(f'session:{sid}')
+    if rate_limiter.allow(keys, cost):
+        return None
+    metrics.inc('captcha_shed_total', reason='rate_limit', endpoint=endpoint)
+    retry_after = max(1, int(math.ceil(cost / app.config['RATE_LIMIT_RATE'])))
+    body = json.dumps({'success': False, 'message': '⏳ Too many requests - slow down', 'retry': True})
+    return Response(body, status=429, mimetype='application/json', headers={'Retry-After': str(retry_after)})
+
+class RateLimitMiddleware:
+    """
+    Rate limiting in front of Flask: a client over its budget is answered after one
+    URL match and a sketch lookup, before the session is opened. Unmatched URLs
+    (404, 405, redirects) are left to Flask.
+    """
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        try:
+            endpoint, _ = app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return self.wsgi_app(environ, start_response)
+        response = shed_over_budget(environ, endpoint)
+        if response is None:
+            return self.wsgi_app(environ, start_response)
+        metrics.observe('captcha_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+        return response(environ, start_response)
+
+# Wrapped before any deployment wrapper (e.g. ProxyFix), which then runs first
+app.wsgi_app = RateLimitMiddleware(app.wsgi_app)
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unmatched'
+    metrics.observe('captcha_request_seconds', elapsed, endpoint=endpoint)
+
+    stage = g.get('challenge_stage')
+    if stage and stage != 'denied' and response.status_code == 200:
+        metrics.observe('captcha_challenge_seconds', elapsed, stage=stage)
+        metrics.inc('captcha_challenges_total', stage=stage, outcome='generated')
+
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        filename = f'{endpoint}_{int(time.time()*1000)}_{random.randint(0,1000)}.prof'
+        profiler.dump_stats(os.path.join(app.config['PROFILE_DIR'], filename))
+        metrics.inc('captcha_profiles_total', endpoint=endpoint)
+    return response
+
 @app.route('/')
 def index():
     if 'stage' not in session:
         init_session()
-    return render_template('index.html')
+    body, encoding, etag = index_page.variant(request.accept_encodings)
+    response = Response(body, mimetype='text/html')
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(etag)
+    # Cached, but revalidated on every visit (an unchanged page is a bodiless 304)
+    response.cache_control.no_cache = True
+    response.cache_control.private = True
+    return response.make_conditional(request)
 
 @app.route('/start_verification', methods=['GET'])
 def start_verification():
@@ -383,13 +2116,13 @@ def get_current_challenge():
     if stage == 'denied':
         return jsonify({'stage': 'denied', 'message': '🚫 ACCESS DENIED'})
     
-    cleanup_old_files('static/images')
-    cleanup_old_files('static/audio')
-    cleanup_old_files('static/generated_captchas')
+    # Delete challenge files that have expired since the last request (O(expired))
+    with metrics.span('sweep'):
+        expiry_index.sweep()
+    g.challenge_stage = stage
     
     if stage == 'text':
-        text = generate_random_text(6)
-        image_file = create_captcha_image(text)
+        text, image_url = generate_text_challenge()
         session['captcha_text'] = text
         session['captcha_time'] = time.time()
         
@@ -397,21 +2130,24 @@ def get_current_challenge():
             'stage': 'text',
             'stage_number': 1,
             'attempts_left': session['text_attempts'],
-            'image': f'/static/images/{image_file}'
+            'image': image_url
         })
     
     elif stage == 'image':
-        images, correct_indices, category = generate_challenge_images()
+        images, sprite, correct_indices, category = generate_challenge_images()
         session['image_correct'] = correct_indices
         session['captcha_time'] = time.time()
         
-        return jsonify({
+        response = {
             'stage': 'image',
             'stage_number': 2,
             'attempts_left': session['image_attempts'],
             'images': images,
             'challenge': category.replace('_', ' ').title()
-        })
+        }
+        if sprite:
+            response['sprite'] = sprite
+        return jsonify(response)
 
     elif stage == 'part':
         image_url, target_box, category = generate_part_selection_challenge()
@@ -430,7 +2166,8 @@ def get_current_challenge():
     
     elif stage == 'voice':
         text = generate_random_text(6)
-        audio_file = create_voice_captcha(text)
+        with render_gate.admit():
+            audio_url = create_voice_captcha(text)
         session['captcha_voice'] = text
         session['captcha_time'] = time.time()
         
@@ -438,9 +2175,22 @@ def get_current_challenge():
             'stage': 'voice',
             'stage_number': 4,
             'attempts_left': session['voice_attempts'],
-            'audio': f'/static/audio/{audio_file}'
+            'audio': audio_url
         })
 
+@app.errorhandler(VoiceUnavailable)
+def voice_unavailable(e):
+    return jsonify({'success': False, 'message': '🔇 Audio challenge unavailable - retrying', 'retry': True}), 503, {'Retry-After': '5'}
+
+@app.errorhandler(RenderQueueFull)
+def render_queue_full(e):
+    return jsonify({'success': False, 'message': '⏳ Server busy - please retry', 'retry': True}), 503, {'Retry-After': '1'}
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    metrics.inc('captcha_shed_total', reason='overload', endpoint=request.endpoint or 'unmatched')
+    return jsonify({'success': False, 'message': '⏳ Server busy - please retry', 'retry': True}), 429, {'Retry-After': '1'}
+
 @app.route('/verify_captcha', methods=['POST'])
 def verify_captcha():
     stage = session.get('stage', 'text')
@@ -451,6 +2201,7 @@ def verify_captcha():
     # Check expiration
     if 'captcha_time' in session:
         if time.time() - session['captcha_time'] > 300:
+            metrics.inc('captcha_challenges_total', stage=stage, outcome='expired')
             return jsonify({'success': False, 'message': '⏱️ CAPTCHA EXPIRED - Generating new challenge', 'expired': True})
     
     is_correct = False
@@ -488,6 +2239,7 @@ def verify_captcha():
         is_correct = (user_answer == correct_answer)
         attempts_key = 'voice_attempts'
     
+    metrics.inc('captcha_challenges_total', stage=stage, outcome='verified' if is_correct else 'failed')
     if is_correct:
         session.clear()
         return jsonify({'success': True, 'message': '✅ VERIFICATION SUCCESSFUL - Access Granted', 'access_granted': True})
@@ -505,7 +2257,16 @@ def verify_captcha():
             })
         else:
             next_stage = progress_to_next_stage()
-            if next_stage == 'denied':
+            if next_stage == stage:
+                return jsonify({
+                    'success': False,
+                    'message': '❌ INCORRECT - Here is a fresh challenge',
+                    'attempts_left': session[attempts_key],
+                    'stage': stage,
+                    'reload_challenge': True
+                })
+            elif next_stage == 'denied':
+                metrics.inc('captcha_challenges_total', stage=stage, outcome='denied')
                 return jsonify({'success': False, 'message': '🚫 ACCESS DENIED - All verification attempts exhausted', 'stage': 'denied', 'access_denied': True})
             else:
                 stage_names = {'image': 'Image Selection', 'part': 'Part Selection', 'voice': 'Audio Verification'}
@@ -516,9 +2277,92 @@ def verify_captcha():
                     'progress_stage': True
                 })
 
+@app.route('/telemetry', methods=['POST'])
+def telemetry():
+    if 'stage' not in session:
+        init_session()
+    stage = session['stage']
+    
+    body = request.get_json(silent=True) or {}
+    points = body.get('points', []) if isinstance(body, dict) else None
+    if not isinstance(points, list):
+        return jsonify({'success': False, 'message': 'Malformed telemetry'}), 400
+    points = points[:app.config['TELEMETRY_MAX_POINTS']]
+    try:
+        bot_sum, count = score_movements(points)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Malformed telemetry'}), 400
+    risk = update_risk(bot_sum, count)
+    windows = session.get('risk_windows', 0)
+    
+    return jsonify({
+        'success': True,
+        'risk': risk,
+        'windows': windows,
+        'bot_probability': session['risk_bot_sum'] / windows if windows else None,
+        'stage': session['stage'],
+        'reload_challenge': session['stage'] != stage
+    })
+
+@app.route('/detector_stats', methods=['GET'])
+def detector_stats():
+    internal_only()
+    if detector is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **detector.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    internal_only()
+    pools = [('image', challenge_pool), ('text', text_pool)]
+    samples = [
+        ('captcha_pool_ready', 'gauge', 'Pre-rendered challenges waiting in a pool',
+         [({'pool': name, 'category': c}, len(q)) for name, pool in pools for c, q in pool.queues.items()]),
+        ('captcha_store_bytes', 'gauge', 'Bytes of challenge media held in memory', [({}, challenge_store.total_bytes)]),
+        ('captcha_store_blobs', 'gauge', 'Challenge media blobs held in memory', [({}, len(challenge_store.blobs))]),
+        ('captcha_render_cache_bytes', 'gauge', 'Bytes of lazily rendered images cached', [({}, render_cache.total_bytes)]),
+        ('captcha_render_active', 'gauge', 'Renders running on request threads', [({}, render_gate.active)]),
+        ('captcha_render_waiting', 'gauge', 'Requests waiting for a render slot', [({}, render_gate.waiting)]),
+    ]
+    if detector is not None:
+        with detector.cond:
+            totals = dict(detector.totals)
+        samples += [(f'captcha_detector_{name}_total', 'counter', f'Bot detector {name} since startup', [({}, value)])
+                    for name, value in totals.items()]
+    return Response(metrics.render(samples), mimetype='text/plain; version=0.0.4')
+
+@app.route('/challenge/lazy/<token>')
+def serve_lazy_challenge(token):
+    challenge = read_challenge_token(token)
+    if challenge is None:
+        abort(404)
+    def render():
+        with render_gate.admit():
+            data = renderer.seeded(*challenge)
+            return data, encoder_of(data).mimetype
+    data, mimetype = render_cache.get(token, render)
+    return Response(data, mimetype=mimetype, headers={'Cache-Control': 'no-store'})
+
+@app.route('/challenge/<blob_id>')
+def serve_challenge(blob_id):
+    blob = challenge_store.get(blob_id)
+    if blob is None:
+        abort(404)
+    data, mimetype = blob
+    return Response(data, mimetype=mimetype, headers={'Cache-Control': 'no-store'})
+
 @app.route('/static/<path:path>')
 def serve_static(path):
-    return send_from_directory('static', path)
+    if path.split('/', 1)[0] in app.config['STATIC_NO_STORE_DIRS']:
+        # Per-challenge media (disk storage mode) is fetched once and never reused
+        response = send_from_directory('static', path, etag=False)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    digest = static_fingerprints.get(path)
+    if digest is None:
+        abort(404)
+    # Cacheable, but revalidated against the ETag
+    return send_from_directory('static', path, etag=digest)
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
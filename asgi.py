@@ -0,0 +1,145 @@
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app as flask_app, challenge_store, metrics, shed_over_budget
+
+# Async (ASGI) serving mode for the verification app.
+#
+#   uvicorn asgi:application --port 5000     (or: python asgi.py)
+#
+# The event loop never runs Flask code itself. Challenge generation and lazy
+# challenge images (PIL renders, TTS) go to a dedicated render executor, so a
+# burst of /get_current_challenge calls can't starve cheap /verify_captcha and
+# static requests, which run on a separate light executor. In-memory challenge
+# media is answered straight from the event loop (still rate limited and timed).
+# The same endpoints are served, so any load generator can be pointed at this
+# and at `python app.py` to compare the two modes.
+
+RENDER_WORKERS = 8   # Threads for /get_current_challenge
+LIGHT_WORKERS = 8    # Threads for everything else routed through Flask
+
+RENDER_PATHS = {'/get_current_challenge'}
+RENDER_PREFIXES = ('/challenge/lazy/',)  # Lazy challenge images are rendered on first fetch
+
+render_executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix='asgi-render')
+light_executor = ThreadPoolExecutor(max_workers=LIGHT_WORKERS, thread_name_prefix='asgi-light')
+
+def build_environ(scope, body):
+    """WSGI environ for an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': scope['client'][0] if scope.get('client') else '',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def call_flask(environ):
+    """Run one request through the Flask app (on an executor thread)"""
+    response = {}
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+    result = flask_app.wsgi_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+async def send_response(send, status, headers, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            render_executor.shutdown(wait=False)
+            light_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path']
+    body = await read_body(receive)
+
+    # In-memory challenge media: a dict lookup, no need to leave the event loop.
+    # Charged to the rate limiter and timed like serve_challenge behind Flask.
+    blob_id = path[len('/challenge/'):]
+    if path.startswith('/challenge/') and '/' not in blob_id and scope['method'] == 'GET':
+        start = time.perf_counter()
+        shed = shed_over_budget(build_environ(scope, body), 'serve_challenge')
+        blob = challenge_store.get(blob_id) if shed is None else None
+        if shed is not None:
+            status, headers, response_body = shed.status_code, shed.headers.to_wsgi_list(), shed.get_data()
+        elif blob is None:
+            status, headers, response_body = 404, [('Content-Type', 'text/plain')], b'Not Found'
+        else:
+            response_body, mimetype = blob
+            status, headers = 200, [
+                ('Content-Type', mimetype),
+                ('Content-Length', str(len(response_body))),
+                ('Cache-Control', 'no-store'),
+            ]
+        metrics.observe('captcha_request_seconds', time.perf_counter() - start, endpoint='serve_challenge')
+        return await send_response(send, status, headers, response_body)
+
+    executor = render_executor if path in RENDER_PATHS or path.startswith(RENDER_PREFIXES) else light_executor
+    loop = asyncio.get_running_loop()
+    status, headers, response_body = await loop.run_in_executor(executor, call_flask, build_environ(scope, body))
+    await send_response(send, status, headers, response_body)
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("The ASGI mode needs an ASGI server: pip install uvicorn")
+    uvicorn.run('asgi:application', host='127.0.0.1', port=5000)
@@ -0,0 +1,451 @@
+import argparse
+import datetime
+import http.cookiejar
+import json
+import logging
+import os
+import platform
+import random
+import socket
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Load generator for the verification ladder. Every simulated session starts a
+# verification, posts one batch of mouse telemetry and then fails its way through
+# text -> image -> part -> voice -> denied, fetching each challenge's media like the
+# browser does. Results go to a JSON file that can be diffed between releases:
+#
+#   python benchmark.py --sessions 200 --concurrency 16                  (Flask test client)
+#   python benchmark.py --target wsgi --output wsgi.json                 (threaded WSGI server)
+#   python benchmark.py --target asgi --compare wsgi.json                (asgi.py under uvicorn)
+#   python benchmark.py --url http://localhost:5000                      (an already running server)
+#   python benchmark.py --encoders 50                                    (image encoder presets, no sessions)
+
+CHALLENGE_DIRS = ['static/images', 'static/audio', 'static/generated_captchas']
+
+# A wrong answer for every stage, so each session walks the whole ladder
+WRONG_ANSWERS = {
+    'text': {'answer': 'WRONG!'},
+    'image': {'selected': []},
+    'part': {'x': -1, 'y': -1},
+    'voice': {'answer': 'WRONG!'},
+}
+
+MAX_ROUNDS = 16  # Safety stop for one session (the full ladder is 8 challenges)
+
+# ============================================================================
+# CLIENTS
+# ============================================================================
+
+class TestClientSession:
+    """One simulated browser on top of the Flask test client (no sockets)"""
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        if method == 'POST':
+            response = self.client.post(path, json=data)
+        else:
+            response = self.client.get(path)
+        return response.status_code, response.get_data()
+
+class HttpSession:
+    """One simulated browser talking HTTP to a server (cookies kept per session)"""
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, data=None):
+        body, headers = None, {}
+        if method == 'POST':
+            body = json.dumps(data).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+# ============================================================================
+# SERVERS
+# ============================================================================
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_wsgi_server(app):
+    """Threaded Werkzeug server (what `python app.py` runs) on a background thread"""
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)  # No access log line per request
+    server = make_server('127.0.0.1', free_port(), app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server.shutdown
+
+def start_asgi_server():
+    """asgi.application under uvicorn on a background thread"""
+    import uvicorn
+    from asgi import application
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(application, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    def stop():
+        server.should_exit = True
+    return f'http://127.0.0.1:{port}', stop
+
+# ============================================================================
+# SIMULATED SESSION
+# ============================================================================
+
+def synthetic_trace(rng, kind, count=60):
+    """[[x, y, t], ...] mouse samples: a wobbly curve with jittered timing, or a bot's straight line"""
+    if kind == 'bot':
+        t = np.arange(count) * 0.01
+        x = np.linspace(100, 600, count)
+        y = np.linspace(200, 400, count)
+    else:
+        t = np.cumsum(rng.uniform(0.008, 0.03, count))
+        steps = np.linspace(0, 1, count)
+        x = 100 + 500 * steps ** 1.5 + rng.normal(0, 2, count)
+        y = 200 + 200 * np.sin(steps * np.pi / 2) + rng.normal(0, 2, count)
+    return np.column_stack((x, y, t)).round(3).tolist()
+
+def media_urls(challenge):
+    """Every URL the browser would load for a challenge response"""
+    urls = []
+    if challenge.get('image'):
+        urls.append(challenge['image'])
+    if challenge.get('sprite'):
+        urls.append(challenge['sprite']['url'])
+    urls.extend(challenge.get('images') or [])
+    if challenge.get('audio'):
+        urls.append(challenge['audio'])
+    return urls
+
+def run_session(client, index, telemetry, seed):
+    """
+    Walk one session down the ladder.
+    Returns [(endpoint, stage, seconds, status, response bytes), ...].
+    """
+    records = []
+    rng = np.random.default_rng(seed + index)
+
+    def call(endpoint, stage, method, path, data=None):
+        start = time.perf_counter()
+        try:
+            status, body = client.request(method, path, data)
+        except Exception as e:
+            print(f"session {index}: {method} {path} failed: {e}")
+            status, body = 0, b''
+        records.append((endpoint, stage, time.perf_counter() - start, status, len(body)))
+        return status, body
+
+    call('start_verification', None, 'GET', '/start_verification')
+    if telemetry != 'none':
+        call('telemetry', None, 'POST', '/telemetry', {'points': synthetic_trace(rng, telemetry)})
+
+    expected = 'text'
+    for _ in range(MAX_ROUNDS):
+        status, body = call('get_current_challenge', expected, 'GET', '/get_current_challenge')
+        try:
+            challenge = json.loads(body)
+        except ValueError:
+            break  # Error page, already counted against the stage we asked for
+        stage = challenge.get('stage', expected)
+        # Label the challenge call with the stage it turned out to be (telemetry can skip text)
+        records[-1] = ('get_current_challenge', stage) + records[-1][2:]
+        if stage == 'denied':
+            break
+
+        for url in media_urls(challenge):
+            call('challenge_media', stage, 'GET', url)
+
+        status, body = call('verify_captcha', stage, 'POST', '/verify_captcha', WRONG_ANSWERS.get(stage, {}))
+        try:
+            result = json.loads(body)
+        except ValueError:
+            break
+        if result.get('stage') == 'denied' or result.get('access_granted'):
+            break
+        expected = result.get('stage', stage)
+    return records
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+def latency_stats(seconds, statuses):
+    ms = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'count': len(ms),
+        'errors': int(sum(1 for status in statuses if not 200 <= status < 400)),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+
+def summarize(records, key):
+    groups = {}
+    for record in records:
+        groups.setdefault(key(record), []).append(record)
+    return {name: latency_stats([r[2] for r in group], [r[3] for r in group])
+            for name, group in sorted(groups.items())}
+
+def memory_usage():
+    """Current and peak resident set size of this process in bytes (None where unavailable)"""
+    usage = {'rss_bytes': None, 'peak_rss_bytes': None}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    usage['rss_bytes'] = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    usage['peak_rss_bytes'] = int(line.split()[1]) * 1024
+    except:
+        try:
+            import resource
+            usage['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except:
+            pass
+    return usage
+
+def disk_snapshot():
+    """{path: size} of every file in the challenge media directories"""
+    sizes = {}
+    for directory in CHALLENGE_DIRS:
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        sizes[entry.path] = entry.stat().st_size
+        except FileNotFoundError:
+            pass
+    return sizes
+
+def disk_written(before, after):
+    grown = {path: size - before.get(path, 0) for path, size in after.items() if size > before.get(path, 0)}
+    return {'bytes_written': sum(grown.values()), 'files_written': len(grown)}
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except:
+        return None
+
+def compare(results, baseline_path):
+    """Print the change of every latency percentile and the throughput against an older run"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nvs {baseline_path} ({baseline['config'].get('target')} @ {baseline.get('git_commit')})")
+    for name, stats in results['endpoints'].items():
+        old = baseline['endpoints'].get(name)
+        if old is None:
+            continue
+        changes = []
+        for p in ['p50_ms', 'p95_ms', 'p99_ms']:
+            delta = (stats[p] - old[p]) / old[p] * 100 if old[p] else 0.0
+            changes.append(f"{p[:-3]} {old[p]:.1f} -> {stats[p]:.1f} ({delta:+.0f}%)")
+        print(f"  {name:24s} " + '  '.join(changes))
+    old_rate = baseline['throughput']['requests_per_second']
+    new_rate = results['throughput']['requests_per_second']
+    print(f"  {'requests/s':24s} {old_rate:.1f} -> {new_rate:.1f}")
+
+# ============================================================================
+# ENCODERS
+# ============================================================================
+
+def challenge_images(app_module, stage, rng):
+    """The PIL images one challenge of a stage is served as, before encoding"""
+    if stage == 'text':
+        text = app_module.generate_random_text(6, rng)
+        pixels = app_module.text_engine.render_arrays([text], np.random.RandomState(rng.getrandbits(32)))
+        return [app_module.Image.fromarray(pixels[0], 'RGB')]
+    category = rng.choice(app_module.CHALLENGE_CATEGORIES)
+    if stage == 'part':
+        return app_module.draw_composites([app_module.plan_part_image(category, rng)[0]])
+    plans, _ = app_module.plan_challenge_grid(category, rng)
+    tiles = app_module.draw_composites(plans)
+    if app_module.app.config['IMAGE_GRID_SPRITE']:
+        return [app_module.compose_sprite_sheet(tiles)]
+    return tiles
+
+def measure_encoders(challenges, seed):
+    """
+    Encode the same rendered challenges of every stage with every available
+    encoder preset: bytes per challenge and encode time per challenge.
+    """
+    import app as app_module
+    rng = random.Random(seed)
+    results = {}
+    for stage in app_module.app.config['IMAGE_ENCODING']:
+        samples = [challenge_images(app_module, stage, rng) for _ in range(challenges)]
+        results[stage] = {}
+        for name, encoder in app_module.IMAGE_ENCODERS.items():
+            if not encoder.available:
+                continue
+            sizes, seconds = [], []
+            for images in samples:
+                start = time.perf_counter()
+                sizes.append(sum(len(encoder.encode(image)) for image in images))
+                seconds.append(time.perf_counter() - start)
+            stats = latency_stats(seconds, [])
+            results[stage][name] = {
+                'bytes_per_challenge': round(float(np.mean(sizes))),
+                'encode_p50_ms': stats['p50_ms'],
+                'encode_p95_ms': stats['p95_ms'],
+                'configured': app_module.app.config['IMAGE_ENCODING'][stage] == name,
+            }
+    return results
+
+def run_encoder_benchmark(args):
+    print(f"Encoding {args.encoders} challenges per stage with every preset...")
+    results = {
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'config': {'mode': 'encoders', 'challenges': args.encoders, 'seed': args.seed},
+        'encoders': measure_encoders(args.encoders, args.seed),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    for stage, presets in results['encoders'].items():
+        for name, stats in sorted(presets.items(), key=lambda item: item[1]['bytes_per_challenge']):
+            mark = '*' if stats['configured'] else ' '
+            print(f"  {stage:6s} {mark}{name:15s} {stats['bytes_per_challenge']:8d} bytes  "
+                  f"encode p50 {stats['encode_p50_ms']:7.2f} ms  p95 {stats['encode_p95_ms']:7.2f} ms")
+    print("  (* = current IMAGE_ENCODING)")
+    print(f"Saved {args.output}")
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='Load and latency benchmark for the verification ladder')
+    parser.add_argument('--sessions', type=int, default=100, help='Simulated sessions to run')
+    parser.add_argument('--concurrency', type=int, default=8, help='Sessions in flight at once')
+    parser.add_argument('--target', choices=['client', 'wsgi', 'asgi'], default='client',
+                        help='Flask test client, threaded WSGI server or asgi.py under uvicorn')
+    parser.add_argument('--url', help='Benchmark an already running server instead (RSS/disk are of this machine)')
+    parser.add_argument('--storage', choices=['lazy', 'memory', 'disk'], help="Override CHALLENGE_STORAGE (in-process targets)")
+    parser.add_argument('--encoding', help='Override IMAGE_ENCODING with one preset for every stage (in-process targets)')
+    parser.add_argument('--encoders', type=int, metavar='CHALLENGES',
+                        help='Instead of sessions, encode CHALLENGES challenges per stage with every encoder preset')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='Keep per-client rate limiting on (every simulated session shares one IP)')
+    parser.add_argument('--telemetry', choices=['human', 'bot', 'none'], default='human', help='Mouse trace each session posts')
+    parser.add_argument('--warmup', type=float, default=2.0, help='Seconds to let the challenge pools fill first')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='Earlier results JSON to print the latency changes against')
+    args = parser.parse_args()
+
+    if args.encoders:
+        return run_encoder_benchmark(args)
+
+    stop = None
+    if args.url:
+        target = 'url'
+        make_client = lambda: HttpSession(args.url)
+    else:
+        from app import app
+        target = args.target
+        if args.storage:
+            app.config['CHALLENGE_STORAGE'] = args.storage
+        if args.encoding:
+            app.config['IMAGE_ENCODING'] = dict.fromkeys(app.config['IMAGE_ENCODING'], args.encoding)
+        app.config['RATE_LIMIT_ENABLED'] = args.rate_limit
+        if target == 'client':
+            make_client = lambda: TestClientSession(app)
+        else:
+            base_url, stop = start_wsgi_server(app) if target == 'wsgi' else start_asgi_server()
+            make_client = lambda: HttpSession(base_url)
+        time.sleep(args.warmup)
+
+    print(f"Running {args.sessions} sessions, {args.concurrency} at a time against {args.url or target}...")
+    memory_before = memory_usage()
+    disk_before = disk_snapshot()
+    started = datetime.datetime.now().isoformat(timespec='seconds')
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        sessions = list(executor.map(
+            lambda i: run_session(make_client(), i, args.telemetry, args.seed),
+            range(args.sessions)
+        ))
+    wall = time.perf_counter() - start
+    memory_after = memory_usage()
+    disk_after = disk_snapshot()
+    if stop:
+        stop()
+
+    records = [record for session in sessions for record in session]
+    results = {
+        'started': started,
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'config': {
+            'target': target,
+            'url': args.url,
+            'sessions': args.sessions,
+            'concurrency': args.concurrency,
+            'storage': args.storage,
+            'encoding': args.encoding,
+            'telemetry': args.telemetry,
+            'rate_limit': args.rate_limit,
+            'seed': args.seed,
+        },
+        'wall_seconds': round(wall, 3),
+        'throughput': {
+            'sessions_per_second': round(args.sessions / wall, 3),
+            'requests_per_second': round(len(records) / wall, 3),
+            'response_bytes_per_second': round(sum(r[4] for r in records) / wall, 1),
+        },
+        'requests': len(records),
+        'errors': sum(1 for r in records if not 200 <= r[3] < 400),
+        'endpoints': summarize(records, lambda r: r[0]),
+        'stages': {
+            stage: summarize([r for r in records if r[1] == stage], lambda r: r[0])
+            for stage in sorted({r[1] for r in records if r[1]})
+        },
+        'disk': disk_written(disk_before, disk_after),
+        'memory': {
+            'rss_before_bytes': memory_before['rss_bytes'],
+            'rss_after_bytes': memory_after['rss_bytes'],
+            'peak_rss_bytes': memory_after['peak_rss_bytes'],
+        },
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{len(records)} requests in {wall:.2f}s ({results['throughput']['requests_per_second']:.1f} req/s, "
+          f"{results['throughput']['sessions_per_second']:.2f} sessions/s), {results['errors']} errors")
+    for name, stats in results['endpoints'].items():
+        print(f"  {name:24s} n={stats['count']:<6d} p50 {stats['p50_ms']:8.2f} ms  "
+              f"p95 {stats['p95_ms']:8.2f} ms  p99 {stats['p99_ms']:8.2f} ms")
+    for stage, endpoints in results['stages'].items():
+        challenge = endpoints.get('get_current_challenge')
+        if challenge:
+            print(f"  stage {stage:18s} challenge p50 {challenge['p50_ms']:8.2f} ms  p99 {challenge['p99_ms']:8.2f} ms")
+    print(f"  disk: {results['disk']['bytes_written']} bytes in {results['disk']['files_written']} files, "
+          f"peak RSS: {memory_after['peak_rss_bytes']} bytes")
+    print(f"Saved {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == '__main__':
+    main()
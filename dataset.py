@@ -0,0 +1,112 @@
+import os
+import shutil
+import numpy as np
+
+# Columnar on-disk format for mouse traces and feature tables. A dataset is a
+# directory of shards (00000/, 00001/, ...) holding one .npy file per column, so
+# readers memory-map only the columns they need and nothing is parsed from text.
+# Trace shards keep the samples of whole traces back to back (x, y, time) plus
+# per-trace columns: offset (start of each trace, with a final end entry) and label.
+
+SAMPLE_COLUMNS = ['x', 'y', 'time']
+
+# A full rebuild of a dataset gets a new ID, so bookkeeping that counts its shards
+# (the model manifest) can tell a rebuilt dataset from one that was only appended to
+BUILD_FILE = 'BUILD'
+
+def shard_paths(directory):
+    """Shard directories of a dataset, in order"""
+    try:
+        names = sorted(name for name in os.listdir(directory) if name.isdigit())
+    except FileNotFoundError:
+        return []
+    return [os.path.join(directory, name) for name in names]
+
+def write_shard(directory, columns):
+    """Write {name: 1-D array} as the next shard of a dataset and return its path"""
+    os.makedirs(directory, exist_ok=True)
+    existing = shard_paths(directory)
+    index = int(os.path.basename(existing[-1])) + 1 if existing else 0
+    path = os.path.join(directory, f'{index:05d}')
+    # Written under a temporary name and renamed, so readers never see half a shard
+    staging = path + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name, values in columns.items():
+        np.save(os.path.join(staging, f'{name}.npy'), np.asarray(values))
+    os.rename(staging, path)
+    return path
+
+def read_shard(path, names=None, mmap=True):
+    """{name: array} for the requested columns of one shard (memory-mapped by default)"""
+    if names is None:
+        names = sorted(f[:-len('.npy')] for f in os.listdir(path) if f.endswith('.npy'))
+    return {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None)
+            for name in names}
+
+def read_build(directory):
+    """ID of the full build that produced a dataset (None if it has none)"""
+    try:
+        with open(os.path.join(directory, BUILD_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def write_build(directory, build):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, BUILD_FILE), 'w') as f:
+        f.write(build)
+
+def iter_shards(directory, names=None):
+    for path in shard_paths(directory):
+        yield read_shard(path, names)
+
+def read_columns(directory, names):
+    """The requested columns of every shard, concatenated into in-memory arrays"""
+    shards = list(iter_shards(directory, names))
+    if not shards:
+        raise FileNotFoundError(f"No shards in {directory}")
+    return {name: np.concatenate([shard[name] for shard in shards]) for name in names}
+
+def iter_traces(shard):
+    """(x, y, time, label) of every trace in a trace shard, as views into the shard"""
+    offsets = shard['offset']
+    for i in range(len(offsets) - 1):
+        start, end = offsets[i], offsets[i + 1]
+        yield shard['x'][start:end], shard['y'][start:end], shard['time'][start:end], str(shard['label'][i])
+
+class TraceWriter:
+    """
+    Appends traces to a trace dataset, cutting a new shard once shard_samples
+    samples are buffered (shards always hold whole traces).
+    """
+    def __init__(self, directory, shard_samples=1000000):
+        self.directory = directory
+        self.shard_samples = shard_samples
+        self.traces = []  # (x, y, time) float64 arrays waiting for the next shard
+        self.labels = []
+        self.buffered = 0
+
+    def add(self, x, y, t, label):
+        trace = tuple(np.asarray(values, dtype=np.float64) for values in (x, y, t))
+        self.traces.append(trace)
+        self.labels.append(label)
+        self.buffered += len(trace[2])
+        if self.buffered >= self.shard_samples:
+            self.flush()
+
+    def flush(self):
+        if not self.traces:
+            return
+        lengths = [len(trace[2]) for trace in self.traces]
+        columns = {name: np.concatenate([trace[i] for trace in self.traces]) for i, name in enumerate(SAMPLE_COLUMNS)}
+        columns['offset'] = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        columns['label'] = np.array(self.labels, dtype=str)
+        write_shard(self.directory, columns)
+        self.traces, self.labels, self.buffered = [], [], 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
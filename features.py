@@ -0,0 +1,141 @@
+import numpy as np
+
+# Mouse movement physics shared by training (process_data.py), serving (app.py)
+# and the live detector (test_detector.py), so the model always sees the same features.
+
+# Samples further apart than this (seconds) are a pause, not movement:
+# no velocity is measured across the gap and no acceleration on either side of it
+MAX_GAP = 1.0
+
+# ----------------------------------------------------------------------------
+# Windowed trajectory features: one row per window of WINDOW_SIZE samples
+# instead of one per sample, so a session is scored with a handful of rows.
+# ----------------------------------------------------------------------------
+
+WINDOW_SIZE = 20
+WINDOW_STRIDE = 10
+
+# A gap between samples longer than this (seconds) counts as a pause
+PAUSE_GAP = 0.1
+
+WINDOW_COLUMNS = [
+    'velocity_mean', 'velocity_std', 'acceleration_std', 'jerk_mean',
+    'curvature_mean', 'angular_velocity_mean', 'dt_variance', 'pause_count',
+    'straightness'
+]
+
+def _windows(values, length, stride, count):
+    """(count, length) strided view of values, one row per window"""
+    return np.lib.stride_tricks.sliding_window_view(values, length)[::stride][:count]
+
+def _masked_mean(values, valid):
+    total = np.where(valid, values, 0.0).sum(axis=1)
+    return total / np.maximum(valid.sum(axis=1), 1)
+
+def window_features(x, y, t, size=WINDOW_SIZE, stride=WINDOW_STRIDE):
+    """
+    Per-window trajectory aggregates for one trace, as a (windows, len(WINDOW_COLUMNS))
+    float64 array. Window k covers samples [k * stride, k * stride + size).
+    """
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    y = np.ascontiguousarray(y, dtype=np.float64)
+    t = np.ascontiguousarray(t, dtype=np.float64)
+
+    # 1. Drop samples whose timestamp doesn't move forward (dt = 0 or clock going backwards)
+    if len(t):
+        keep = np.ones(len(t), dtype=bool)
+        keep[1:] = t[1:] > np.maximum.accumulate(t)[:-1]
+        x, y, t = x[keep], y[keep], t[keep]
+    count = (len(t) - size) // stride + 1 if len(t) >= size else 0
+    if count == 0:
+        return np.empty((0, len(WINDOW_COLUMNS)))
+
+    # 2. Per-segment physics (segment j joins samples j and j + 1)
+    dx, dy, dt = np.diff(x), np.diff(y), np.diff(t)
+    distance = np.hypot(dx, dy)
+    moving = dt <= MAX_GAP
+    velocity = np.where(moving, distance / dt, 0.0)
+    heading = np.arctan2(dy, dx)
+
+    # 3. Second and third order terms between consecutive segments
+    acceleration = np.diff(velocity) / dt[1:]
+    acceleration_ok = moving[1:] & moving[:-1]
+    turn = (np.diff(heading) + np.pi) % (2 * np.pi) - np.pi
+    turn_ok = acceleration_ok & (distance[1:] > 0) & (distance[:-1] > 0)
+    angular_velocity = np.abs(turn) / dt[1:]
+    curvature = np.abs(turn) / np.where(distance[1:] > 0, distance[1:], 1.0)
+    jerk = np.abs(np.diff(acceleration)) / dt[2:]
+    jerk_ok = acceleration_ok[1:] & acceleration_ok[:-1]
+
+    # 4. Aggregate over strided windows
+    v = _windows(velocity, size - 1, stride, count)
+    v_ok = _windows(moving, size - 1, stride, count)
+    v_mean = _masked_mean(v, v_ok)
+    v_std = np.sqrt(_masked_mean((v - v_mean[:, None]) ** 2, v_ok))
+
+    a = _windows(acceleration, size - 2, stride, count)
+    a_ok = _windows(acceleration_ok, size - 2, stride, count)
+    a_mean = _masked_mean(a, a_ok)
+    a_std = np.sqrt(_masked_mean((a - a_mean[:, None]) ** 2, a_ok))
+
+    angle_ok = _windows(turn_ok, size - 2, stride, count)
+    gaps = _windows(dt, size - 1, stride, count)
+    path = _windows(distance, size - 1, stride, count).sum(axis=1)
+    starts = np.arange(count) * stride
+    net = np.hypot(x[starts + size - 1] - x[starts], y[starts + size - 1] - y[starts])
+
+    return np.column_stack((
+        v_mean,
+        v_std,
+        a_std,
+        _masked_mean(_windows(jerk, size - 3, stride, count), _windows(jerk_ok, size - 3, stride, count)),
+        _masked_mean(_windows(curvature, size - 2, stride, count), angle_ok),
+        _masked_mean(_windows(angular_velocity, size - 2, stride, count), angle_ok),
+        gaps.var(axis=1),
+        (gaps > PAUSE_GAP).sum(axis=1),
+        np.where(path > 0, net / np.where(path > 0, path, 1.0), 1.0),
+    ))
+
+class WindowStream:
+    """
+    Incremental version of window_features for traces that arrive in chunks.
+    Only the samples of the next, not yet complete window are kept (fewer than
+    size), so the state per trace is bounded however long it runs, and pushing a
+    trace chunk by chunk yields exactly the rows of one batch call.
+    """
+    def __init__(self, size=WINDOW_SIZE, stride=WINDOW_STRIDE, tail=None, latest=None):
+        self.size = size
+        self.stride = stride
+        self.tail = np.asarray(tail if tail is not None else np.empty((0, 3)), dtype=np.float64).reshape(-1, 3)
+        self.latest = latest  # Largest timestamp seen so far (samples must move past it)
+
+    def push(self, x, y, t):
+        """Window rows completed by the new samples"""
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        y = np.ascontiguousarray(y, dtype=np.float64)
+        t = np.ascontiguousarray(t, dtype=np.float64)
+        if len(t):
+            # Same cleaning as window_features, continued across chunks
+            seen = np.maximum.accumulate(t if self.latest is None else np.maximum(t, self.latest))
+            keep = np.empty(len(t), dtype=bool)
+            keep[0] = self.latest is None or t[0] > self.latest
+            keep[1:] = t[1:] > seen[:-1]
+            self.latest = float(seen[-1])
+            samples = np.concatenate((self.tail, np.column_stack((x[keep], y[keep], t[keep]))))
+        else:
+            samples = self.tail
+
+        rows = window_features(samples[:, 0], samples[:, 1], samples[:, 2], self.size, self.stride)
+        # Keep everything from the start of the next window on
+        self.tail = samples[len(rows) * self.stride:] if len(rows) else samples
+        return rows
+
+    def state(self):
+        """JSON-serializable state, restored with WindowStream.from_state"""
+        return {'tail': self.tail.tolist(), 'latest': self.latest}
+
+    @classmethod
+    def from_state(cls, state, size=WINDOW_SIZE, stride=WINDOW_STRIDE):
+        if not state:
+            return cls(size, stride)
+        return cls(size, stride, tail=state['tail'], latest=state['latest'])
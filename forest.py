@@ -0,0 +1,146 @@
+import os
+import json
+import zipfile
+import numpy as np
+
+# Flat, memory-mappable export of the captcha_guard RandomForestClassifier.
+# All trees are concatenated into one set of node arrays and written as an
+# uncompressed .npz, which np.load() can read as usual but which serving
+# processes memory-map directly so forked workers share one copy of the pages.
+
+def export_forest(model, path):
+    """
+    Write a fitted RandomForestClassifier as flat node arrays to an .npz file.
+    The file is written next to path and renamed over it, so a server watching
+    path only ever sees a complete model.
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        # Child indices are shifted into the concatenated node space (leaves keep -1)
+        left = np.where(tree.children_left >= 0, tree.children_left + offset, -1)
+        right = np.where(tree.children_right >= 0, tree.children_right + offset, -1)
+        # Leaf class distributions, normalized like DecisionTreeClassifier.predict_proba
+        value = tree.value[:, 0, :].astype(np.float64)
+        total = value.sum(axis=1, keepdims=True)
+        value /= np.where(total == 0, 1, total)
+
+        roots.append(offset)
+        features.append(tree.feature.astype(np.int32))
+        thresholds.append(tree.threshold.astype(np.float64))
+        lefts.append(left.astype(np.int32))
+        rights.append(right.astype(np.int32))
+        values.append(value)
+        offset += tree.node_count
+
+    names = getattr(model, 'feature_names_in_', None)
+    staging = path + '.tmp'
+    with open(staging, 'wb') as f:
+        np.savez(
+            f,
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            value=np.concatenate(values),
+            roots=np.array(roots, dtype=np.int32),
+            classes=np.asarray(model.classes_).astype(str),
+            feature_names=np.asarray(names if names is not None else [], dtype=str),
+            max_depth=np.array(max(e.tree_.max_depth for e in model.estimators_), dtype=np.int32)
+        )
+    os.replace(staging, path)
+
+def _mmap_npz(path):
+    """Memory-map every array stored (uncompressed) in an .npz file"""
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, 'rb') as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{info.filename} in {path} is compressed and can't be memory-mapped")
+            # Skip the zip local header to reach the .npy payload
+            f.seek(info.header_offset)
+            header = f.read(30)
+            name_length = int.from_bytes(header[26:28], 'little')
+            extra_length = int.from_bytes(header[28:30], 'little')
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[:-len('.npy')]
+            if dtype.hasobject:
+                raise ValueError(f"{name} in {path} holds Python objects")
+            if shape == () or 0 in shape:
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return arrays
+
+class FlatForest:
+    """
+    Pure NumPy evaluator for a forest written by export_forest. Exposes the parts
+    of the sklearn classifier API the app uses (classes_, predict_proba, predict).
+    """
+    def __init__(self, arrays):
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.value = arrays['value']
+        self.roots = np.asarray(arrays['roots'])
+        self.classes_ = np.asarray(arrays['classes']).astype(object)
+        self.max_depth = int(arrays['max_depth'])
+        names = np.asarray(arrays['feature_names'])
+        self.feature_names_in_ = names.astype(object) if len(names) else None
+        self.n_features_in_ = len(names) if len(names) else int(self.feature.max()) + 1
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        if mmap:
+            return cls(_mmap_npz(path))
+        with np.load(path) as data:
+            return cls({name: data[name] for name in data.files})
+
+    def predict_proba(self, X):
+        """Mean leaf class distribution over all trees, evaluated for every row at once"""
+        # sklearn compares float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32).astype(np.float64)
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            feature = self.feature[nodes]
+            internal = feature >= 0
+            if not internal.any():
+                break
+            go_left = X[rows, np.where(internal, feature, 0)] <= self.threshold[nodes]
+            step = np.where(go_left, self.left[nodes], self.right[nodes])
+            nodes = np.where(internal, step, nodes)
+        return self.value[nodes].mean(axis=1)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def read_manifest(path='captcha_guard.json'):
+    """Training bookkeeping of the published model ({} before the first publish)"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def publish_model(model, manifest, prefix='captcha_guard'):
+    """
+    Publish a new model version: the joblib pickle (what retraining warm-starts
+    from), the flat .npz servers hot-swap, then the manifest. Each file is
+    replaced atomically.
+    """
+    import joblib
+    joblib.dump(model, prefix + '.pkl.tmp')
+    os.replace(prefix + '.pkl.tmp', prefix + '.pkl')
+    export_forest(model, prefix + '.npz')
+    with open(prefix + '.json.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(prefix + '.json.tmp', prefix + '.json')
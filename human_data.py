@@ -1,20 +1,32 @@
-import pandas as pd
+import csv
+from collections import deque
 from pynput import mouse
 import time
 
-data = []
+events = deque()
 print("Move your mouse around like you're solving a CAPTCHA. Press 'Esc' (manual stop) or wait 30 seconds.")
 
 def on_move(x, y):
     # Record the x, y position and the current time
-    data.append({'x': x, 'y': y, 'time': time.time(), 'label': 'human'})
+    events.append((x, y, time.time(), 'human'))
 
-# Start listening for 5 seconds
-with mouse.Listener(on_move=on_move) as listener:
-    time.sleep(30) 
-    listener.stop()
+def write_pending(writer):
+    """Write out the events recorded since the last call"""
+    rows = [events.popleft() for _ in range(len(events))]
+    writer.writerows(rows)
+    return len(rows)
 
-# Save to a CSV file
-df = pd.DataFrame(data)
-df.to_csv('human_data.csv', index=False)
-print(f"Captured {len(df)} data points. Saved to human_data.csv")
\ No newline at end of file
+# Record for 30 seconds, streaming rows to the CSV file in chunks so memory use stays flat
+count = 0
+with open('human_data.csv', 'w', newline='') as f:
+    writer = csv.writer(f)
+    writer.writerow(['x', 'y', 'time', 'label'])
+    with mouse.Listener(on_move=on_move) as listener:
+        end = time.time() + 30
+        while time.time() < end:
+            time.sleep(0.5)
+            count += write_pending(writer)
+        listener.stop()
+    count += write_pending(writer)
+
+print(f"Captured {count} data points. Saved to human_data.csv")
\ No newline at end of file
@@ -1,42 +1,119 @@
-import pandas as pd
+import os
+import sys
+import shutil
+import secrets
 import numpy as np
+import pandas as pd
+from features import window_features, WINDOW_COLUMNS
+from dataset import TraceWriter, iter_shards, iter_traces, read_shard, shard_paths, write_build, write_shard
+
+RAW_FILES = ['human_data.csv', 'bot_data.csv']
+TRACE_DIR = 'traces'            # Columnar trace store (see dataset.py)
+FEATURE_DIR = 'training_data'   # Columnar windowed features, one shard per trace shard
+RAW_SHARDS = 'RAW_SHARDS'       # File in TRACE_DIR: how many leading shards came from RAW_FILES
 
-def calculate_features(df):
-    # 1. Calculate the difference between the current row and the previous row
-    # diff() calculates: (Current Value - Previous Value)
-    df['dx'] = df['x'].diff() # Change in X
-    df['dy'] = df['y'].diff() # Change in Y
-    df['dt'] = df['time'].diff() # Change in Time
+def import_csv(path, writer, chunksize=100000):
+    # One recording file is one trace. It is parsed in chunks of plain float
+    # columns, so no full DataFrame of the file is ever built.
+    parts, label = [], None
+    for chunk in pd.read_csv(path, usecols=['x', 'y', 'time', 'label'], chunksize=chunksize):
+        parts.append(chunk[['x', 'y', 'time']].to_numpy(dtype=np.float64))
+        label = chunk['label'].iloc[0] if label is None and len(chunk) else label
+    samples = np.concatenate(parts) if parts else np.empty((0, 3))
+    writer.add(samples[:, 0], samples[:, 1], samples[:, 2], label)
+    return len(samples)
 
-    # 2. Calculate Distance (Pythagorean theorem: a^2 + b^2 = c^2)
-    # This tells us the total length of the jump between points
-    df['distance'] = np.sqrt(df['dx']**2 + df['dy']**2)
+def count_raw_shards(trace_dir):
+    # Leading trace shards imported from RAW_FILES; the ones after them were appended
+    # (e.g. by a TraceWriter) and exist nowhere else. None if the store can't tell.
+    try:
+        with open(os.path.join(trace_dir, RAW_SHARDS)) as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return 0 if not shard_paths(trace_dir) else None
 
-    # 3. Calculate Velocity (Speed = Distance / Time)
-    df['velocity'] = df['distance'] / df['dt']
+def import_raw_files(trace_dir):
+    # Rebuild the CSV part of the trace store. Appended shards are kept and follow
+    # the freshly imported ones; the store is swapped in only once it is complete.
+    raw = count_raw_shards(trace_dir)
+    if raw is None:
+        sys.exit(f"{trace_dir}/ has no {RAW_SHARDS} file, so imported and appended traces "
+                 f"can't be told apart. Move it away to rebuild it from {', '.join(RAW_FILES)}.")
+    appended = shard_paths(trace_dir)[raw:]
+    staging = trace_dir + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    with TraceWriter(staging) as writer:
+        for path in RAW_FILES:
+            print(f"Imported {import_csv(path, writer)} samples from {path}")
+    os.makedirs(staging, exist_ok=True)
+    imported = len(shard_paths(staging))
+    for i, path in enumerate(appended):
+        os.rename(path, os.path.join(staging, f'{imported + i:05d}'))
+    with open(os.path.join(staging, RAW_SHARDS), 'w') as f:
+        f.write(str(imported))
+    shutil.rmtree(trace_dir, ignore_errors=True)
+    os.rename(staging, trace_dir)
+    if appended:
+        print(f"Kept {len(appended)} appended trace shards")
 
-    # 4. Calculate Acceleration (Change in Velocity / Time)
-    df['acceleration'] = df['velocity'].diff() / df['dt']
+def shard_window_features(shard):
+    # Windowed features of every trace in one trace shard, as feature columns.
+    # 'trace' is the index of the source trace in the shard, so training can keep
+    # all windows of one recording session on the same side of a split.
+    values, labels, traces = [np.empty((0, len(WINDOW_COLUMNS)))], [], []
+    for i, (x, y, t, label) in enumerate(iter_traces(shard)):
+        rows = window_features(x, y, t)
+        values.append(rows)
+        labels.extend([label] * len(rows))
+        traces.extend([i] * len(rows))
+    values = np.vstack(values)
+    columns = {name: values[:, i] for i, name in enumerate(WINDOW_COLUMNS)}
+    columns['label'] = np.array(labels, dtype=str)
+    columns['trace'] = np.array(traces, dtype=np.int32)
+    return columns
 
-    # 5. Clean up: The first row will be empty (NaN) because there's no previous row to compare to
-    df = df.dropna()
-    
-    # We only care about the behavioral features now, not the raw x/y positions
-    return df[['velocity', 'acceleration', 'label']]
+def process_shards(trace_dir, feature_dir):
+    # Chunked feature pass: one trace shard is memory-mapped and processed at a
+    # time, and the new feature set replaces the old one only once it is complete.
+    # It gets a new build ID, so retrain.py won't mistake it for the shards the
+    # published model was trained on.
+    staging = feature_dir + '.tmp'
+    shutil.rmtree(staging, ignore_errors=True)
+    total = 0
+    for shard in iter_shards(trace_dir):
+        columns = shard_window_features(shard)
+        write_shard(staging, columns)
+        total += len(columns['label'])
+    write_build(staging, secrets.token_hex(8))
+    shutil.rmtree(feature_dir, ignore_errors=True)
+    if os.path.isdir(staging):
+        os.rename(staging, feature_dir)
+    return total
 
-# Load the raw files
-human_raw = pd.read_csv('human_data.csv')
-bot_raw = pd.read_csv('bot_data.csv')
+def process_new_shards(trace_dir, feature_dir):
+    # Incremental pass: feature shard i is always made from trace shard i, so only
+    # trace shards appended since the last run (e.g. by a TraceWriter) are processed
+    done = len(shard_paths(feature_dir))
+    total = 0
+    for path in shard_paths(trace_dir)[done:]:
+        columns = shard_window_features(read_shard(path))
+        write_shard(feature_dir, columns)
+        total += len(columns['label'])
+    return total
 
-# Process them
-human_features = calculate_features(human_raw)
-bot_features = calculate_features(bot_raw)
+if __name__ == '__main__':
+    if '--incremental' in sys.argv:
+        # New traces only: feed the result to retrain.py
+        total = process_new_shards(TRACE_DIR, FEATURE_DIR)
+        print(f"Processed new trace shards: {total} new windows in {FEATURE_DIR}/")
+        sys.exit()
 
-# Combine them into one "Training Set"
-final_data = pd.concat([human_features, bot_features])
+    # 1. Import the raw recordings into the columnar trace store
+    import_raw_files(TRACE_DIR)
 
-# Save the smart data
-final_data.to_csv('training_data.csv', index=False)
+    # 2. Turn the traces into windowed features, shard by shard
+    total = process_shards(TRACE_DIR, FEATURE_DIR)
 
-print("Data processed! We converted raw positions into Speed and Acceleration.")
-print(final_data.head())
\ No newline at end of file
+    print(f"Data processed! {total} windows of trajectory features saved to {FEATURE_DIR}/")
+    preview = next(iter_shards(FEATURE_DIR))
+    print(pd.DataFrame({name: preview[name][:5] for name in WINDOW_COLUMNS + ['label']}))
@@ -0,0 +1,78 @@
+import time
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import accuracy_score
+from features import WINDOW_COLUMNS
+from forest import publish_model, read_manifest
+from dataset import read_build, read_shard, shard_paths
+
+# Incremental retraining of captcha_guard. Feature shards added to training_data/
+# since the published model was trained (python process_data.py --incremental)
+# are fitted as extra trees on the existing forest (warm start), the oldest trees
+# are retired beyond MAX_TREES, and the new version is published atomically.
+# Running servers pick it up without a restart (MODEL_RELOAD_INTERVAL in app.py).
+
+TREES_PER_UPDATE = 20   # Trees fitted on each batch of new windows
+MAX_TREES = 200         # Oldest trees are dropped beyond this
+MIN_WINDOWS = 50        # New windows needed before an update is worth it
+
+# 1. Load the published model and find the feature shards it hasn't seen
+manifest = read_manifest()
+try:
+    model = joblib.load('captcha_guard.pkl')
+except:
+    print("Error: captcha_guard.pkl not found! Run train_model.py first.")
+    exit()
+
+# Shard counts only carry over while training_data/ is the build the model was
+# trained on; after a full process_data.py run the model has to be retrained
+if manifest.get('feature_build') != read_build('training_data'):
+    print("training_data/ was rebuilt since the published model was trained. Run train_model.py first.")
+    exit()
+
+all_shards = shard_paths('training_data')
+new_shards = all_shards[manifest.get('feature_shards', 0):]
+if not new_shards:
+    print(f"No new training data since version {manifest.get('version', 0)}.")
+    exit()
+
+# 2. Read only the feature columns of the new shards
+columns = WINDOW_COLUMNS + ['label']
+shards = [read_shard(path, columns) for path in new_shards]
+df = pd.DataFrame({name: np.concatenate([shard[name] for shard in shards]) for name in columns})
+if len(df) < MIN_WINDOWS:
+    print(f"Only {len(df)} new windows, waiting for {MIN_WINDOWS}.")
+    exit()
+if set(df['label']) != set(model.classes_):
+    print(f"New windows must cover every class {list(model.classes_)}, got {sorted(set(df['label']))}.")
+    exit()
+
+X = df[WINDOW_COLUMNS]
+y = df['label']
+
+# 3. How the current version does on windows it has never seen
+before = accuracy_score(y, model.predict(X)) * 100
+
+# 4. Grow the forest on the new windows and retire the oldest trees
+model.set_params(warm_start=True, n_estimators=len(model.estimators_) + TREES_PER_UPDATE)
+model.fit(X, y)
+if len(model.estimators_) > MAX_TREES:
+    model.estimators_ = model.estimators_[-MAX_TREES:]
+    model.n_estimators = MAX_TREES
+
+# 5. Publish the new version (servers hot-swap captcha_guard.npz)
+version = manifest.get('version', 0) + 1
+publish_model(model, {
+    'version': version,
+    'trees': len(model.estimators_),
+    'feature_shards': len(all_shards),
+    'feature_build': manifest.get('feature_build'),
+    'windows': manifest.get('windows', 0) + len(df),
+    'trained_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    'mode': 'incremental'
+})
+print("---------------------------------------")
+print(f"Version {version}: {len(df)} new windows from {len(new_shards)} shards, "
+      f"{len(model.estimators_)} trees (previous version scored {before:.2f}% on them)")
+print("---------------------------------------")
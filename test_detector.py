@@ -1,6 +1,7 @@
-import pandas as pd
 import numpy as np
-import joblib
+from collections import deque
+from features import WindowStream
+from forest import FlatForest
 from pynput import mouse
 import time
 
@@ -8,43 +9,55 @@ import time
 print("--------------------------------------------------")
 print("SYSTEM LOADING...")
 try:
-    model = joblib.load('captcha_guard.pkl')
+    model = FlatForest.load('captcha_guard.npz')
     print("AI Model Loaded Successfully.")
 except:
-    print("Error: captcha_guard.pkl not found!")
+    print("Error: captcha_guard.npz not found! Run train_model.py first.")
     exit()
 
-# 2. RECORD LIVE MOVEMENT
-data = []
+# 2. STREAM LIVE MOVEMENT
+# Mouse events are scored chunk by chunk while they arrive, and the check ends as
+# soon as the verdict is clear instead of after a fixed recording time
+MAX_SECONDS = 10
+CHUNK_SECONDS = 0.25
+MIN_WINDOWS = 5        # Scored windows needed before stopping early
+DECISION_MARGIN = 0.3  # Stop early once the bot ratio is this far from 50%
+
+events = deque()
+stream = WindowStream()
+bot_hits = 0
+total = 0
 print("--------------------------------------------------")
-print("SECURITY CHECK: Move your mouse for 5 SECONDS")
+print(f"SECURITY CHECK: Move your mouse (up to {MAX_SECONDS} SECONDS)")
 print("--------------------------------------------------")
 
 def on_move(x, y):
-    data.append({'x': x, 'y': y, 'time': time.time()})
+    events.append((x, y, time.time()))
 
 listener = mouse.Listener(on_move=on_move)
 listener.start()
-time.sleep(10)
+deadline = time.time() + MAX_SECONDS
+while time.time() < deadline:
+    time.sleep(CHUNK_SECONDS)
+    chunk = [events.popleft() for _ in range(len(events))]
+    if not chunk:
+        continue
+
+    # 3. ANALYZE THE NEW CHUNK
+    points = np.array(chunk, dtype=np.float64)
+    # Calculate physics (same windowed features the model was trained on)
+    X_input = stream.push(points[:, 0], points[:, 1], points[:, 2])
+    if len(X_input) > 0:
+        # 4. PREDICT (one vote per movement window)
+        predictions = model.predict(X_input)
+        bot_hits += np.sum(predictions == 'bot')
+        total += len(predictions)
+        print(f"  {total} windows scored, bot probability so far {bot_hits / total * 100:.0f}%")
+        if total >= MIN_WINDOWS and abs(bot_hits / total - 0.5) >= DECISION_MARGIN:
+            break
 listener.stop()
 
-# 3. ANALYZE DATA
-if len(data) > 5:
-    df = pd.DataFrame(data)
-    # Calculate physics
-    df['dx'] = df['x'].diff().fillna(0)
-    df['dy'] = df['y'].diff().fillna(0)
-    df['dt'] = df['time'].diff().fillna(0.01)
-    df['velocity'] = np.sqrt(df['dx']**2 + df['dy']**2) / df['dt']
-    df['acceleration'] = df['velocity'].diff().fillna(0)
-
-    # 4. PREDICT
-    X_input = df[['velocity', 'acceleration']]
-    predictions = model.predict(X_input)
-    
-    # Count results
-    bot_hits = np.sum(predictions == 'bot')
-    total = len(predictions)
+if total > 0:
     bot_ratio = (bot_hits / total) * 100
 
     print(f"Analysis Complete. Bot Probability: {bot_ratio:.2f}%")